@@ -1,4 +1,8 @@
 import akshare as ak
+import pandas as pd
+from datetime import datetime, timedelta
+from tools.rate_limiter import RateLimiter
+from tools.metrics import registry
 
 
 class AKShareAPI:
@@ -31,3 +35,82 @@ class AKShareAPI:
             return self.get_hk_tickers()
         else:
             raise ValueError(f"Invalid region: '{region}'.")
+
+    @staticmethod
+    def get_daily_prices(symbol, start_date, end_date, region):
+        """
+        下载单只股票的后复权日线，列名与 YahooAPI.get_daily_prices_by_symbols 的返回一致。
+
+        增量下载的新日线要与已存储的日线处于同一价格基准。前复权（qfq）在每次分红、拆股后会重算全部历史，
+        新旧数据的基准不一致；后复权（hfq）的历史价格固定不变，均线、52 周高低点和 RS 不会因除权跳变。
+
+        :param start_date: 开始日期（包含），YYYY-MM-DD
+        :param end_date: 结束日期（包含），YYYY-MM-DD
+        """
+        start_date = start_date.replace('-', '')
+        end_date = end_date.replace('-', '')
+        if region == 'cn':
+            df = ak.stock_zh_a_hist(symbol=symbol, period='daily', start_date=start_date, end_date=end_date,
+                                    adjust='hfq')
+        elif region == 'hk':
+            df = ak.stock_hk_hist(symbol=symbol, period='daily', start_date=start_date, end_date=end_date,
+                                  adjust='hfq')
+        else:
+            raise ValueError(f"Invalid region: '{region}'.")
+
+        if df is None or df.empty:
+            return pd.DataFrame()
+        df = df.rename(columns={'日期': 'date', '开盘': 'open', '最高': 'high', '最低': 'low', '收盘': 'close',
+                                '成交量': 'volume'})
+        df['symbol'] = symbol
+        # 已是后复权价格
+        df['adj_close'] = df['close']
+        return df[['date', 'open', 'high', 'low', 'close', 'adj_close', 'volume', 'symbol']]
+
+
+class AKSharePriceProvider:
+    """
+    cn / hk 股票的日线数据源，接口与 YahooAPI 的日线下载部分一致，可直接用于 DailyPrices。
+
+    AKShare 没有多只股票的历史日线接口，批次内逐只下载，所有下载线程共享同一个限流器。
+
+    :param region: cn 或 hk
+    :param requests_per_second: 每秒请求数上限
+    """
+
+    def __init__(self, region, requests_per_second=5.0):
+        if region not in ('cn', 'hk'):
+            raise ValueError(f"Invalid region: '{region}'.")
+        self.region = region
+        self.limiter = RateLimiter(requests_per_second, capacity=int(max(1, requests_per_second)))
+
+    def get_daily_prices_by_symbols(self, symbols, start_date, end_date):
+        """
+        :param end_date: 结束日期（不包含），与 yfinance 一致
+        """
+        # AKShare 的结束日期包含在内
+        last_date = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+        frames = []
+        errors = 0
+        for symbol in symbols:
+            self.limiter.acquire()
+            try:
+                df = AKShareAPI.get_daily_prices(symbol, start_date, last_date, self.region)
+            except Exception as e:
+                errors += 1
+                print(f"Error downloading {self.region} prices for {symbol}: {e}")
+                continue
+            if not df.empty:
+                frames.append(df)
+
+        registry.counter('symbols_fetched_total', 'Symbols downloaded').inc(len(frames), region=self.region)
+        registry.counter('akshare_symbol_errors_total', 'Symbols that failed to download from AKShare').inc(
+            errors, region=self.region)
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def flush_ticker_status():
+        # AKShare 不区分 delisted / invalid，不回写股票状态
+        return {}
@@ -2,11 +2,14 @@ import configparser as cp
 import pandas as pd
 import numpy as np
 import requests
-import csv
 from tools import utils
 import os
 
 
+# 单次请求超时秒数
+REQUEST_TIMEOUT = 30
+
+
 class AlphaVantageAPI:
     def __init__(self):
         config = cp.ConfigParser()
@@ -17,7 +20,7 @@ class AlphaVantageAPI:
 
     @staticmethod
     def request_data(url):
-        r = requests.get(url)
+        r = requests.get(url, timeout=REQUEST_TIMEOUT)
         data = r.json()
         return data
 
@@ -33,8 +36,11 @@ class AlphaVantageAPI:
             url += '&maturity={}'.format(maturity)
 
         data = self.request_data(url)
-        df = pd.DataFrame(data['data'])
-        return df
+        return self.parse_macro_indicator(data)
+
+    @staticmethod
+    def parse_macro_indicator(data):
+        return pd.DataFrame(data['data'])
 
     ############################
     #     fundamental APIs     #
@@ -42,7 +48,10 @@ class AlphaVantageAPI:
 
     def get_earnings(self, symbol):
         data = self.query_fundamental_by_symbol('EARNINGS', symbol)
+        return self.parse_earnings(data, symbol)
 
+    @staticmethod
+    def parse_earnings(data, symbol):
         # 提取年度数据
         annual_earnings = data['annualEarnings']
         # 提取季度数据
@@ -116,18 +125,15 @@ class AlphaVantageAPI:
 
     def get_tickers(self):
         url = '{}?function={}&apikey={}&state={}'.format(self.base_url, 'LISTING_STATUS', self.api_key, 'active')
-        with requests.Session() as s:
-            download = s.get(url)
-            decoded_content = download.content.decode('utf-8')
-            cr = csv.reader(decoded_content.splitlines(), delimiter=',')
-            data = list(cr)
-        # 将 CSV 数据转换为 DataFrame
-        df = pd.DataFrame(data[1:], columns=data[0])  # 第一行为列名
-
-        # 只保留 symbol, name, exchange 三个字段
-        df = df[['symbol', 'name', 'exchange', 'ipoDate', 'status']]
-        df.rename(columns={"ipoDate": "ipo_date"}, inplace=True)
+        with requests.get(url, stream=True, timeout=REQUEST_TIMEOUT) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            # 边下载边解析 CSV，不在内存中保留整个文本；symbol 等列保持字符串（如 'NA' 不能被当作空值）
+            df = pd.read_csv(r.raw, usecols=['symbol', 'name', 'exchange', 'ipoDate', 'status'],
+                             dtype=str, keep_default_na=False)
 
+        df.rename(columns={"ipoDate": "ipo_date"}, inplace=True)
+        df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce').dt.date
         return df
 
 
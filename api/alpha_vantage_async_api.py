@@ -0,0 +1,199 @@
+import asyncio
+import configparser as cp
+import os
+import random
+import aiohttp
+from api.alpha_vantage_api import AlphaVantageAPI
+from tools import utils
+from tools.rate_limiter import AsyncQuotaScheduler, QuotaExceededError
+from tools.metrics import registry
+
+#####################################
+# AlphaVantage 异步客户端
+# 共享一个连接池，请求按分钟/每天配额调度，失败时指数退避重试
+# usage:
+# async with AsyncAlphaVantageAPI() as av_api:
+#     earnings = await av_api.get_earnings_batch(['AAPL', 'MSFT'])
+# 或同步调用：
+# earnings = fetch_earnings_batch(['AAPL', 'MSFT'])
+#####################################
+
+
+# 免费 key 的默认配额
+DEFAULT_REQUESTS_PER_MINUTE = 5
+DEFAULT_REQUESTS_PER_DAY = 25
+# 需要重试的 HTTP 状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class AlphaVantageError(Exception):
+    pass
+
+
+class AsyncAlphaVantageAPI:
+    """
+    :param base_url: 接口地址，默认读取配置文件（离线测试时可指向本地服务）
+    :param api_key: API key，默认读取配置文件
+    :param per_minute: 每分钟请求数配额，默认读取配置文件 requests_per_minute
+    :param per_day: 每天请求数配额，默认读取配置文件 requests_per_day
+    :param max_connections: 连接池大小
+    :param retries: 失败后的最大重试次数
+    :param backoff: 首次重试前等待的秒数，之后每次翻倍
+    :param timeout: 单次请求超时秒数
+    """
+
+    def __init__(self, base_url=None, api_key=None, per_minute=None, per_day=None, max_connections=10,
+                 retries=3, backoff=1.0, timeout=30):
+        config = cp.ConfigParser()
+        config_path = os.path.join(utils.get_root_path(), 'config', 'stock.config')
+        config.read(config_path, encoding='utf-8-sig')
+
+        self.base_url = base_url or config.get('AlphaVantage', 'base_url')
+        self.api_key = api_key or config.get('AlphaVantage', 'api_key')
+        if per_minute is None:
+            per_minute = config.getint('AlphaVantage', 'requests_per_minute', fallback=DEFAULT_REQUESTS_PER_MINUTE)
+        if per_day is None:
+            per_day = config.getint('AlphaVantage', 'requests_per_day', fallback=DEFAULT_REQUESTS_PER_DAY)
+
+        self.scheduler = AsyncQuotaScheduler(per_minute, per_day)
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def _get_once(self, params):
+        async with self.session.get(self.base_url, params=params) as response:
+            if response.status in RETRY_STATUS:
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=response.reason)
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+        # 超出频率限制时接口仍返回 200，内容为 Note 或 Information
+        if 'Note' in data or 'Information' in data:
+            raise AlphaVantageError(data.get('Note') or data.get('Information'))
+        if 'Error Message' in data:
+            # 参数错误，重试没有意义
+            raise ValueError(data['Error Message'])
+        return data
+
+    async def request_data(self, **params):
+        """
+        按配额发出请求并返回 JSON，失败时指数退避重试。每次重试同样占用配额。
+        """
+        if self.session is None:
+            raise RuntimeError("AsyncAlphaVantageAPI must be used as 'async with AsyncAlphaVantageAPI() as api'.")
+        params['apikey'] = self.api_key
+
+        for attempt in range(self.retries + 1):
+            await self.scheduler.acquire()
+            try:
+                data = await self._get_once(params)
+                registry.counter('alpha_vantage_requests_total', 'AlphaVantage requests').inc(status='success')
+                return data
+            except (aiohttp.ClientError, asyncio.TimeoutError, AlphaVantageError) as e:
+                registry.counter('alpha_vantage_requests_total', 'AlphaVantage requests').inc(status='retry')
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+                # 不打印异常中的 URL，避免泄露 api key
+                reason = getattr(e, 'status', None) or str(e) or type(e).__name__
+                print(f"{params.get('function')} request failed ({reason}), retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+
+    async def query_fundamental_by_symbol(self, function, symbol):
+        return await self.request_data(function=function, symbol=symbol)
+
+    async def query_macro_indicator(self, function, interval=None, maturity=None):
+        params = {'function': function}
+        if interval:
+            params['interval'] = interval
+        if maturity:
+            params['maturity'] = maturity
+        data = await self.request_data(**params)
+        return AlphaVantageAPI.parse_macro_indicator(data)
+
+    async def _gather(self, keys, coroutines):
+        """
+        并发执行，返回 ({key: 结果}, {key: 异常})。每日配额用尽时不再等待剩余请求。
+        """
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        values, errors = {}, {}
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                errors[key] = result
+            else:
+                values[key] = result
+        if len(errors) > 0:
+            quota_errors = sum(isinstance(e, QuotaExceededError) for e in errors.values())
+            print(f"{len(errors)} requests failed ({quota_errors} over daily quota).")
+        return values, errors
+
+    ############################
+    #     fundamental APIs     #
+    ############################
+
+    async def get_earnings(self, symbol):
+        data = await self.query_fundamental_by_symbol('EARNINGS', symbol)
+        return AlphaVantageAPI.parse_earnings(data, symbol)
+
+    async def get_earnings_batch(self, symbols):
+        """
+        并发获取多只股票的财报，返回 ({symbol: (年度, 季度)}, {symbol: 异常})。
+        """
+        return await self._gather(symbols, [self.get_earnings(symbol) for symbol in symbols])
+
+    ############################
+    #        macro APIs        #
+    ############################
+
+    async def get_macro_indicators(self, indicators):
+        """
+        并发获取多个宏观指标。
+
+        :param indicators: {名称: (function, interval, maturity)}，如 {'cpi': ('CPI', 'monthly', None)}
+        :return: ({名称: DataFrame}, {名称: 异常})
+        """
+        return await self._gather(list(indicators),
+                                  [self.query_macro_indicator(*spec) for spec in indicators.values()])
+
+
+def fetch_earnings_batch(symbols, **kwargs):
+    """
+    AsyncAlphaVantageAPI.get_earnings_batch 的同步入口。
+    """
+    async def run():
+        async with AsyncAlphaVantageAPI(**kwargs) as av_api:
+            return await av_api.get_earnings_batch(symbols)
+    return asyncio.run(run())
+
+
+def fetch_macro_indicators(indicators, **kwargs):
+    """
+    AsyncAlphaVantageAPI.get_macro_indicators 的同步入口。
+    """
+    async def run():
+        async with AsyncAlphaVantageAPI(**kwargs) as av_api:
+            return await av_api.get_macro_indicators(indicators)
+    return asyncio.run(run())
+
+
+if __name__ == '__main__':
+    values, errors = fetch_macro_indicators({
+        'real_gdp': ('REAL_GDP', 'quarterly', None),
+        'cpi': ('CPI', 'monthly', None),
+        'treasury_yield_10y': ('TREASURY_YIELD', 'monthly', '10year'),
+    })
+    for name, df in values.items():
+        print(name, df.head())
@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from tools import utils
+
+
+class FundamentalsCache:
+    """
+    本地财务数据缓存，按 symbol 存储每个财季的数据。
+
+    缓存在以下情况失效：
+    - 超过 ttl_days 天未刷新；
+    - 按最新财季推算，下一季财报应已发布，但缓存是在那之前获取的。
+    """
+
+    # 相邻两个财季结束日的间隔天数
+    QUARTER_DAYS = 91
+    # 财季结束后财报发布的延迟天数（10-Q 一般在 40~45 天内发布）
+    REPORT_LAG_DAYS = 45
+
+    def __init__(self, name='quarterly_net_income', ttl_days=7):
+        self.cache_dir = os.path.join(utils.get_root_path(), 'cache', 'fundamentals', name)
+        self.ttl = timedelta(days=ttl_days)
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, symbol):
+        return os.path.join(self.cache_dir, f'{symbol}.json')
+
+    def _is_expired(self, entry, now):
+        fetched_at = datetime.fromisoformat(entry['fetched_at'])
+        if now - fetched_at > self.ttl:
+            return True
+
+        quarters = entry['quarters']
+        if len(quarters) == 0:
+            return False
+
+        # 下一季财报的预计发布日期
+        latest_quarter = datetime.fromisoformat(max(quarters))
+        next_report_date = latest_quarter + timedelta(days=self.QUARTER_DAYS + self.REPORT_LAG_DAYS)
+        return fetched_at < next_report_date <= now
+
+    def get(self, symbol):
+        """
+        读取缓存，返回 {财季结束日: 数值}，缓存不存在或已失效时返回 None。
+        """
+        path = self._path(symbol)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        if self._is_expired(entry, datetime.now()):
+            return None
+        return entry['quarters']
+
+    def set(self, symbol, quarters):
+        entry = {
+            'fetched_at': datetime.now().isoformat(),
+            'quarters': quarters
+        }
+        with self.lock:
+            with open(self._path(symbol), 'w') as f:
+                json.dump(entry, f)
@@ -2,48 +2,117 @@ import yfinance as yf
 import pandas as pd
 import logging
 import re
+import ast
+import threading
 from tools import utils
-import os
+from tools.metrics import registry
+from concurrent.futures import ThreadPoolExecutor
 from database import mydb
+from api.fundamentals_cache import FundamentalsCache
+
+
+def classify_download_error(message):
+    """
+    根据 yfinance 的错误信息判断 symbol 的状态：delisted / invalid / proxy_error / error。
+    """
+    if re.search(r"(YFPricesMissingError|YFTzMissingError).*delisted", message):
+        return 'delisted'
+    if 'YFInvalidPeriodError' in message:
+        return 'invalid'
+    if 'ProxyError' in message:
+        return 'proxy_error'
+    return 'error'
+
+
+class DownloadErrorCollector(logging.Handler):
+    """
+    在内存中收集一次 yf.download 调用的下载错误。
+
+    yfinance 以 "['AAA', 'BBB']: 错误信息" 的格式记录失败的 symbols，
+    只收集属于本次调用的 symbols，因此并发的多个批次互不干扰。
+    """
+
+    PATTERN = re.compile(r"^(\[.*?\]): (.*)$", re.S)
+
+    def __init__(self, symbols):
+        super().__init__(level=logging.ERROR)
+        self.symbols = set(symbols)
+        self.errors = {}
+
+    def emit(self, record):
+        match = self.PATTERN.match(record.getMessage())
+        if not match:
+            return
+        try:
+            symbols = ast.literal_eval(match.group(1))
+        except (ValueError, SyntaxError):
+            return
+        for symbol in symbols:
+            if symbol in self.symbols:
+                self.errors[symbol] = match.group(2)
+
+
+class DownloadResult:
+    """
+    一次下载的结果：价格数据和每个 symbol 的状态（ok / delisted / invalid / proxy_error / error）。
+    """
+
+    def __init__(self, prices, status):
+        self.prices = prices
+        self.status = status
+
+    def symbols_with_status(self, status):
+        return [symbol for symbol, value in self.status.items() if value == status]
 
 
 class YahooAPI:
 
+    # 需要写回 tickers 表的状态
+    TICKER_STATUS = {
+        'delisted': 'Delisted',
+        'invalid': 'Invalid'
+    }
+
     def __init__(self):
-        root_path = utils.get_root_path()
-        self.error_log = os.path.join(root_path, 'log', 'yfinance_download_errors.log')
-        # self.error_log = 'yfinance_download_errors.log'
-        # 配置日志
-        logging.basicConfig(
-            filename=self.error_log,  # 日志文件名
-            level=logging.ERROR,  # 记录错误及以上级别的信息
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        self.fundamentals_cache = FundamentalsCache()
+        # 本次运行中待写回 tickers 表的 symbol 状态
+        self.pending_ticker_status = {}
+        self.status_lock = threading.Lock()
 
-    def get_daily_prices_by_symbols(self, symbols, start_date, end_date):
+    @utils.timer(metric='yahoo_request_duration_seconds')
+    def download_daily_prices_by_symbols(self, symbols, start_date, end_date):
+        """
+        下载多只股票的日线数据，并在内存中记录每个 symbol 的下载状态。
+
+        :return: DownloadResult
+        """
+        collector = DownloadErrorCollector(symbols)
+        yf_logger = logging.getLogger('yfinance')
+        yf_logger.addHandler(collector)
         try:
-            # 清空日志文件
-            with open(self.error_log, 'w'):  # 以写模式打开文件会清空内容
-                pass
             # 从 Yahoo API 下载数据
             df = yf.download(symbols, start=start_date, end=end_date, group_by='ticker')
         except Exception as e:
             print("exception: ", e)
+            df = pd.DataFrame()
+        finally:
+            yf_logger.removeHandler(collector)
 
-        proxy_error_symbols, delisted_symbols, invalid_symbols = self.extract_delisted_symbols()
-        print(f"\n{len(delisted_symbols)} delisted symbols found.")
-        print(f"{len(invalid_symbols)} invalid symbols found.")
-        print(f"{len(proxy_error_symbols)} proxy error symbols found.")
+        status = {symbol: 'ok' for symbol in symbols}
+        for symbol, message in collector.errors.items():
+            status[symbol] = classify_download_error(message)
+        result = DownloadResult(pd.DataFrame(), status)
 
-        # 更新数据库
-        if len(delisted_symbols) > 0:
-            mydb.update_ticker_status('Delisted', delisted_symbols)
-        if len(invalid_symbols) > 0:
-            mydb.update_ticker_status('Invalid', invalid_symbols)
+        symbol_errors = registry.counter('yahoo_symbol_errors_total', 'Symbols that failed to download by reason')
+        for reason in ['delisted', 'invalid', 'proxy_error', 'error']:
+            count = len(result.symbols_with_status(reason))
+            symbol_errors.inc(count, reason=reason)
+            if count > 0:
+                print(f"{count} {reason} symbols found.")
 
         # 检查是否获取到数据
-        if df.empty:
-            return pd.DataFrame()  # 返回空 DataFrame
+        if df is None or df.empty:
+            return result
         # 转换格式
         result_list = []
         for symbol in symbols:
@@ -60,6 +129,10 @@ class YahooAPI:
                 print(f"Warning: No data found for symbol {symbol}. Skipping.")
                 continue
 
+        registry.counter('symbols_fetched_total', 'Symbols downloaded').inc(len(result_list), region='us')
+        if len(result_list) == 0:
+            return result
+
         # 合并所有数据
         result_df = pd.concat(result_list)
 
@@ -76,77 +149,118 @@ class YahooAPI:
         }
 
         result_df.rename(columns=new_columns, inplace=True)
+        result.prices = result_df
+        return result
+
+    def get_daily_prices_by_symbols(self, symbols, start_date, end_date):
+        """
+        下载多只股票的日线数据，delisted / invalid 的 symbol 暂存起来，由 flush_ticker_status 统一写回。
+        """
+        result = self.download_daily_prices_by_symbols(symbols, start_date, end_date)
+        with self.status_lock:
+            for symbol, status in result.status.items():
+                if status in self.TICKER_STATUS:
+                    self.pending_ticker_status[symbol] = self.TICKER_STATUS[status]
+        return result.prices
 
-        return result_df
+    def flush_ticker_status(self):
+        """
+        将本次运行累计的 symbol 状态一次性写回 tickers 表，返回写回的 {symbol: status}。
+        """
+        with self.status_lock:
+            pending = self.pending_ticker_status
+            self.pending_ticker_status = {}
+        if len(pending) > 0:
+            mydb.update_ticker_statuses(pending)
+            print(f"Updated status of {len(pending)} tickers.")
+        return pending
 
     @staticmethod
-    def get_quarterly_growth(symbol):
+    @utils.timer(metric='yahoo_request_duration_seconds')
+    def fetch_quarterly_net_income(symbol):
+        """
+        从 Yahoo 下载季度净利润（Normalized Income），返回 {财季结束日: 净利润}。
+        """
         # 获取股票数据
         stock = yf.Ticker(symbol)
 
-        current_net_income = -1
-        growth_rate = -1
-
         # 获取季度财务数据
         quarterly_financials = stock.quarterly_financials
         try:
-            # 提取最新四个季度的净利润
             net_income = quarterly_financials.loc['Normalized Income']
+        except KeyError:
+            print(f"{symbol} has no Normalized Income data.")
+            return {}
 
-            # 确保有足够的数据
-            if len(net_income) < 5:
-                print("Not enough quarterly data to calculate growth.")
-            else:
-                current_quarter = net_income.index[0]
-                previous_quarter = net_income.index[4]
-
-                if net_income[previous_quarter] != 0:  # 避免除以零
-                    growth_rate = ((net_income[current_quarter] - net_income[previous_quarter]) / net_income[
-                        previous_quarter]) * 100
-                    current_net_income = net_income[current_quarter]
-                else:
-                    print("Previous net income zero")
-        except Exception as e:
-            # 捕获异常并返回0
-            print(f"{symbol} Exception: ", e)
+        # 缺失值保存为 None，保证同比时仍然对齐到四个季度之前
+        return {pd.Timestamp(quarter).strftime('%Y-%m-%d'): None if pd.isna(value) else float(value)
+                for quarter, value in net_income.items()}
 
-        return current_net_income, growth_rate
+    def get_quarterly_net_income(self, symbol):
+        """
+        优先从本地缓存读取季度净利润，缓存缺失或失效时从 Yahoo 下载。
+        """
+        quarters = self.fundamentals_cache.get(symbol)
+        registry.counter('fundamentals_cache_requests_total').inc(result='miss' if quarters is None else 'hit')
+        if quarters is None:
+            quarters = self.fetch_quarterly_net_income(symbol)
+            self.fundamentals_cache.set(symbol, quarters)
+        return quarters
 
-    def extract_delisted_symbols(self):
-        delisted_symbols = []
-        proxy_error_symbols = []
-        invalid_symbols = []
+    @staticmethod
+    def calculate_quarterly_growth(quarters):
+        """
+        计算最新季度净利润的同比增长率。
 
-        # 读取日志文件
-        with open(self.error_log, 'r') as file:
-            for line in file:
-                # 查找可能被 delisted 的符号
-                delisted_match = re.search(r"\['(.*?)'\]: (YFPricesMissingError|YFTzMissingError).*delisted", line)
-                if delisted_match:
-                    delisted_symbols.append(delisted_match.group(1))
+        :param quarters: {财季结束日: 净利润}
+        :return: (最新季度净利润, 同比增长率%)，数据不足时均为 -1
+        """
+        current_net_income = -1
+        growth_rate = -1
 
-                # 查找可能是 proxy 错误的符号
-                proxy_match = re.search(r"\['(.*?)'\]: ProxyError", line)
-                if proxy_match:
-                    proxy_error_symbols.append(proxy_match.group(1))
+        # 按财季倒序排列，最新的在前
+        net_income = pd.Series(quarters, dtype='float64').sort_index(ascending=False)
 
-                # 查找可能是无效的符号
-                invalid_match = re.search(r"\['(.*?)'\]: YFInvalidPeriodError", line)
-                if invalid_match:
-                    invalid_symbols.append(invalid_match.group(1))
+        # 确保有足够的数据
+        if len(net_income) < 5:
+            print("Not enough quarterly data to calculate growth.")
+        else:
+            current_quarter = net_income.index[0]
+            previous_quarter = net_income.index[4]
 
-        # 确保没有重合的符号
-        proxy_error_symbols = [symbol for symbol in proxy_error_symbols if symbol not in delisted_symbols]
-        proxy_error_symbols = [symbol for symbol in proxy_error_symbols if symbol not in invalid_symbols]
+            if net_income[previous_quarter] != 0:  # 避免除以零
+                growth_rate = ((net_income[current_quarter] - net_income[previous_quarter]) / net_income[
+                    previous_quarter]) * 100
+                current_net_income = net_income[current_quarter]
+            else:
+                print("Previous net income zero")
 
-        return proxy_error_symbols, delisted_symbols, invalid_symbols
+        return current_net_income, growth_rate
+
+    def get_quarterly_growth(self, symbol):
+        try:
+            quarters = self.get_quarterly_net_income(symbol)
+        except Exception as e:
+            # 捕获异常并返回 -1
+            print(f"{symbol} Exception: ", e)
+            return -1, -1
+        return self.calculate_quarterly_growth(quarters)
+
+    def get_quarterly_growth_batch(self, symbols, workers=8):
+        """
+        批量获取多只股票的季度利润同比增长，缓存未命中的 symbol 并发下载。
+
+        :return: {symbol: (最新季度净利润, 同比增长率%)}
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(self.get_quarterly_growth, symbols)
+            return dict(zip(symbols, results))
 
 
 if __name__ == '__main__':
     yahoo_api = YahooAPI()
-    yahoo_api.get_daily_prices_by_symbols(['AAPL','AMD','ADSE','JFR-R-W','JFBRW'], '2024-10-20', '2024-10-24')
+    result = yahoo_api.download_daily_prices_by_symbols(['AAPL','AMD','ADSE','JFR-R-W','JFBRW'], '2024-10-20', '2024-10-24')
+    print(result.status)
     #print(yahoo_api.get_quarterly_growth('AAPL'))
     #print(yahoo_api.get_quarterly_growth('AAPL'))
 
-    #print(yahoo_api.extract_delisted_symbols())
-
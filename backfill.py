@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from database import mydb
+import trading_calendar
+
+#####################################
+# 缺失日线的补齐计划
+# 对比每只股票已存储的日期与交易日历（从 ipo_date 或首条数据开始），得到精确的缺失区间；
+# 缺失区间相同的股票合并为一次请求，只下载和写入缺失的日线
+# usage:
+# import backfill
+# requests = backfill.plan_backfill('us')
+#####################################
+
+
+# 相隔不超过该交易日数的两个缺口合并为一次请求（写入前会剔除已存在的日线）
+MERGE_GAP_SESSIONS = 5
+
+
+def find_gaps(calendar, coverage, existing, merge_gap=MERGE_GAP_SESSIONS, extra_dates=0):
+    """
+    计算每只股票缺失的交易日区间。
+
+    股票的起始交易日为 ipo_date；ipo_date 未知时为第一条已存储数据的日期（之前的日期可能尚未上市，不算缺失），
+    没有任何数据时为日历的第一天。
+
+    :param calendar: 升序的交易日列表（YYYY-MM-DD）
+    :param coverage: mydb.query_price_coverage 的结果
+    :param existing: 不完整股票已存在的 (symbol, date)
+    :param merge_gap: 相隔不超过该交易日数的缺口合并
+    :param extra_dates: 价格表中不在日历内的日期数，bars 可能包含这些日期
+    :return: DataFrame，列为 symbol, start_date, end_date（均为交易日，包含在内）
+    """
+    columns = ['symbol', 'start_date', 'end_date']
+    if len(calendar) == 0 or coverage.empty:
+        return pd.DataFrame(columns=columns)
+
+    cal = np.array(calendar, dtype='datetime64[D]')
+    n = len(cal)
+
+    ipo_date = pd.to_datetime(coverage['ipo_date'], errors='coerce')
+    first_date = pd.to_datetime(coverage['first_date'], errors='coerce')
+    start = ipo_date.fillna(first_date).to_numpy(dtype='datetime64[D]')
+    first_pos = np.where(np.isnat(start), 0, np.searchsorted(cal, start, side='left'))
+    expected = n - first_pos
+
+    incomplete = coverage.assign(first_pos=first_pos)[coverage['bars'].to_numpy() < expected + extra_dates]
+    if incomplete.empty:
+        return pd.DataFrame(columns=columns)
+
+    # 每只不完整股票应有的交易日序号
+    counts = n - incomplete['first_pos'].to_numpy()
+    symbols = np.repeat(incomplete['symbol'].to_numpy(), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(incomplete['first_pos'].to_numpy(), counts) + offsets
+    expected_bars = pd.DataFrame({'symbol': symbols, 'position': positions})
+
+    # 已存在日期转为交易日序号，不在日历中的日期忽略
+    existing_dates = pd.to_datetime(existing['date']).to_numpy(dtype='datetime64[D]')
+    existing_pos = np.searchsorted(cal, existing_dates)
+    in_calendar = (existing_pos < n) & (cal[np.minimum(existing_pos, n - 1)] == existing_dates)
+    present = pd.DataFrame({'symbol': existing['symbol'].to_numpy()[in_calendar],
+                            'position': existing_pos[in_calendar]}).drop_duplicates()
+
+    merged = expected_bars.merge(present, on=['symbol', 'position'], how='left', indicator=True)
+    missing = merged[merged['_merge'] == 'left_only'][['symbol', 'position']]
+    if missing.empty:
+        return pd.DataFrame(columns=columns)
+
+    # 相邻缺失日之间的间隔超过 merge_gap 时开始新的区间
+    missing = missing.sort_values(['symbol', 'position'])
+    step = missing.groupby('symbol')['position'].diff()
+    run = (step.isna() | (step > merge_gap + 1)).cumsum()
+    ranges = missing.groupby(run).agg(symbol=('symbol', 'first'), start=('position', 'min'), end=('position', 'max'))
+
+    return pd.DataFrame({
+        'symbol': ranges['symbol'].to_numpy(),
+        'start_date': pd.to_datetime(cal[ranges['start'].to_numpy()]).strftime('%Y-%m-%d'),
+        'end_date': pd.to_datetime(cal[ranges['end'].to_numpy()]).strftime('%Y-%m-%d'),
+    })
+
+
+def group_requests(gaps, batch_size=100):
+    """
+    把缺失区间相同的股票合并为下载请求。
+
+    :return: [{'start_date', 'end_date', 'symbols'}]，end_date 不包含在内（与 yfinance 一致）
+    """
+    requests = []
+    for (start_date, end_date), group in gaps.groupby(['start_date', 'end_date']):
+        symbols = sorted(group['symbol'].tolist())
+        end_date = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        for i in range(0, len(symbols), batch_size):
+            requests.append({'start_date': start_date, 'end_date': end_date, 'symbols': symbols[i:i + batch_size]})
+    return requests
+
+
+def plan_backfill(region, sessions=mydb.REALTIME_SESSIONS, batch_size=100):
+    """
+    计算某个地区最近 sessions 个交易日内需要补齐的下载请求。
+
+    交易日取自 trading_calendar，并剔除整个地区都没有数据的交易日：规则未覆盖的休市日（如清明、中秋）
+    不算缺失，最新数据日期之后的交易日由每日更新下载。
+    """
+    calendar = trading_calendar.get_calendar(region)
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = calendar.sessions_start(sessions, end_date)
+    observed = set(mydb.query_trading_dates(region, start_date, min_share=0))
+    calendar = [day for day in calendar.sessions_between(start_date, end_date) if day in observed]
+    if len(calendar) == 0:
+        return []
+    extra_dates = len(observed) - len(calendar)
+
+    coverage = mydb.query_price_coverage(region, calendar[0])
+    # 数据量可能不足的股票才需要逐日对比
+    candidates = coverage[coverage['bars'] < len(calendar) + extra_dates]
+    existing = mydb.query_existing_dates_by_symbols(candidates['symbol'].tolist(), calendar[0], calendar[-1])
+
+    gaps = find_gaps(calendar, coverage, existing, extra_dates=extra_dates)
+    requests = group_requests(gaps, batch_size)
+    print(f"Region '{region}': {gaps['symbol'].nunique()} symbols with {len(gaps)} gaps, "
+          f"{len(requests)} requests planned.")
+    return requests
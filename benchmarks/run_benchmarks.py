@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+from contextlib import contextmanager
+from datetime import datetime
+
+#####################################
+# 数据入库与筛选各阶段的基准测试
+# 使用合成行情、本地 SQLite 数据库和不访问网络的行情源，结果保存为 JSON 便于对比
+# usage:
+# python -m benchmarks.run_benchmarks --symbols 1000 --years 2
+#####################################
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_DIR = os.path.join(ROOT_PATH, 'benchmarks', 'results')
+
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE tickers (
+        symbol VARCHAR(20) PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        region VARCHAR(50),
+        exchange VARCHAR(50),
+        ipo_date DATE,
+        status VARCHAR(255)
+    )
+    """,
+    """
+    CREATE TABLE daily_stock_prices_realtime (
+        date DATE NOT NULL,
+        symbol VARCHAR(10) NOT NULL,
+        adj_close DECIMAL(15, 4),
+        close DECIMAL(15, 4),
+        high DECIMAL(15, 4),
+        low DECIMAL(15, 4),
+        open DECIMAL(15, 4),
+        volume BIGINT,
+        PRIMARY KEY (symbol, date)
+    )
+    """,
+    """
+    CREATE TABLE daily_stock_moving_averages (
+        date DATE NOT NULL,
+        symbol VARCHAR(10) NOT NULL,
+        current_price DECIMAL(15, 4),
+        ma_50 DECIMAL(15, 4),
+        ma_150 DECIMAL(15, 4),
+        ma_200 DECIMAL(15, 4),
+        high_of_52weeks DECIMAL(15, 4),
+        low_of_52weeks DECIMAL(15, 4),
+        PRIMARY KEY (symbol, date)
+    )
+    """,
+    """
+    CREATE TABLE screening_output (
+        symbol VARCHAR(10) PRIMARY KEY,
+        ma_200_up_trend BOOLEAN NOT NULL DEFAULT FALSE,
+        profit_up_trend BOOLEAN NOT NULL DEFAULT FALSE,
+        cup_with_handle BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """
+]
+
+
+@contextmanager
+def timed(results, stage, **extra):
+    print(f"Running {stage}...")
+    start_time = time.perf_counter()
+    yield extra
+    elapsed = time.perf_counter() - start_time
+    results[stage] = {'seconds': elapsed, **extra}
+    print(f"{stage} finished in {elapsed:.2f}s {extra}")
+
+
+def run(n_symbols, years, seed=0, batch_size=100, charts=20):
+    work_dir = tempfile.mkdtemp(prefix='stock_wizard_bench_')
+    # 必须在导入 mydb 之前指定数据库
+    os.environ['STOCK_WIZARD_DB_URL'] = 'sqlite:///' + os.path.join(work_dir, 'bench.db')
+
+    from database import mydb
+    from database import price_cache
+    from daily_prices import DailyPrices
+    from monitor import Monitor
+    from benchmarks.synthetic import FakeYahooAPI, make_symbols, make_dates
+    from tools.metrics import registry
+    import indicators
+    import indicator_store
+    import pandas as pd
+
+    for sql in SQLITE_SCHEMA:
+        mydb.execute_sql(sql)
+    price_cache.CACHE_DIR = os.path.join(work_dir, 'cache', 'prices')
+    indicator_store.CACHE_DIR = os.path.join(work_dir, 'cache', 'indicators')
+
+    symbols = make_symbols(n_symbols)
+    mydb.write_df_to_table(pd.DataFrame({'symbol': symbols, 'name': symbols, 'region': 'us',
+                                         'exchange': 'NYSE', 'ipo_date': None, 'status': 'Active'}), 'tickers')
+
+    fake_api = FakeYahooAPI(n_symbols, years, seed)
+    # DailyPrices 的入库与筛选流程不使用 Tickers
+    dp = DailyPrices(yahoo_api=fake_api, tickers=types.SimpleNamespace())
+    dates = make_dates(years)
+    start_date = dates[0].strftime('%Y-%m-%d')
+    end_date = (dates[-1] + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+    results = {}
+
+    with timed(results, 'ingest') as extra:
+        rows = 0
+        for i in range(0, len(symbols), batch_size):
+            rows += dp.update_daily_prices_by_symbols(symbols[i:i + batch_size], start_date, end_date, mode='insert')
+        extra['rows'] = rows
+
+    with timed(results, 'price_cache_sync') as extra:
+        extra['rows'] = price_cache.sync()
+
+    # 与 DailyPrices.update_moving_averages 一致，通过增量状态计算均线
+    with timed(results, 'moving_averages') as extra:
+        store = indicator_store.IndicatorStore()
+        store.rebuild()
+        ma_df = store.snapshot(symbols)
+        mydb.write_df_to_table(ma_df, 'daily_stock_moving_averages')
+        store.clear_dirty()
+        extra['rows'] = len(ma_df)
+
+    with timed(results, 'moving_averages_incremental') as extra:
+        # 每只股票一根新日线，只更新内存中的状态，不写入价格表
+        next_date = (dates[-1] + pd.offsets.BDay()).strftime('%Y-%m-%d')
+        new_bars = pd.DataFrame({'symbol': ma_df['symbol'], 'date': next_date,
+                                 'close': ma_df['current_price'] * 1.01})
+        extra['bars'] = store.apply(new_bars)
+        extra['rows'] = len(store.snapshot(store.dirty_symbols()))
+
+    with timed(results, 'sql_filter') as extra:
+        screening_df = mydb.apply_sql_filter()
+        mydb.write_df_to_table(screening_df, 'screening_output')
+        extra['rows'] = len(screening_df)
+
+    with timed(results, 'slope_filter') as extra:
+        sma_df = dp.calculate_sma()
+        slopes = dp.calculate_slopes(sma_df, 'ma_200', 20)
+        extra['symbols'] = len(slopes)
+
+    with timed(results, 'rs_ratings') as extra:
+        rs_df = indicators.calculate_rs_ratings()
+        extra['rows'] = len(rs_df)
+
+    with timed(results, 'cup_with_handle') as extra:
+        screening_prices = price_cache.get_screening_results()
+        cups = dp.detect_cup_with_handle_batch(screening_prices)
+        extra['symbols'] = len(cups)
+        extra['found'] = int(cups['cup_with_handle'].sum())
+
+    with timed(results, 'chart_rendering') as extra:
+        monitor = Monitor(output_root=os.path.join(work_dir, 'output'))
+        chart_symbols = screening_prices['symbol'].drop_duplicates().head(charts).tolist()
+        dfs = [group for _, group in screening_prices[screening_prices['symbol'].isin(chart_symbols)].groupby('symbol')]
+        extra.update(monitor.plot_stocks_in_grid(dfs))
+
+    report = {
+        'run_at': datetime.now().isoformat(),
+        'params': {'symbols': n_symbols, 'years': years, 'seed': seed, 'batch_size': batch_size, 'charts': charts},
+        'python': sys.version.split()[0],
+        'stages': results,
+        'metrics': registry.snapshot()['metrics']
+    }
+
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    result_path = os.path.join(RESULT_DIR, datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    with open(result_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {result_path}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ingest and screening stages on a synthetic universe.')
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--charts', type=int, default=20)
+    args = parser.parse_args()
+    run(args.symbols, args.years, args.seed, args.batch_size, args.charts)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+#####################################
+# 基准测试用的合成行情数据
+# 相同的 seed 和 symbol 序号总是生成相同的数据
+#####################################
+
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def make_symbols(n_symbols):
+    return [f'SYN{i:05d}' for i in range(n_symbols)]
+
+
+def make_dates(years, end_date=None):
+    if end_date is None:
+        end_date = datetime.now().strftime('%Y-%m-%d')
+    return pd.bdate_range(end=end_date, periods=int(years * TRADING_DAYS_PER_YEAR))
+
+
+def generate_symbol_prices(symbol, symbol_index, dates, seed=0):
+    """
+    用几何随机游走生成单只股票的日线数据，列名与 YahooAPI.get_daily_prices_by_symbols 的返回一致。
+    """
+    rng = np.random.default_rng([seed, symbol_index])
+    n = len(dates)
+
+    drift = rng.normal(0.0003, 0.0005)
+    volatility = rng.uniform(0.01, 0.04)
+    start_price = rng.uniform(5, 300)
+
+    close = start_price * np.exp(np.cumsum(rng.normal(drift, volatility, n)))
+    open_ = close * (1 + rng.normal(0, volatility / 3, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, n)))
+    volume = rng.lognormal(13, 1, n).astype('int64')
+
+    return pd.DataFrame({
+        'date': dates,
+        'open': open_.round(4),
+        'high': high.round(4),
+        'low': low.round(4),
+        'close': close.round(4),
+        'adj_close': close.round(4),
+        'volume': volume,
+        'symbol': symbol
+    })
+
+
+def iter_ohlcv(n_symbols, years, seed=0, chunk_symbols=500, end_date=None):
+    """
+    分块生成 n_symbols 只股票 years 年的日线数据，避免一次占用过多内存。
+    """
+    dates = make_dates(years, end_date)
+    symbols = make_symbols(n_symbols)
+    for i in range(0, n_symbols, chunk_symbols):
+        yield pd.concat([generate_symbol_prices(symbol, i + j, dates, seed)
+                         for j, symbol in enumerate(symbols[i:i + chunk_symbols])], ignore_index=True)
+
+
+def generate_ohlcv(n_symbols, years, seed=0, end_date=None):
+    return pd.concat(iter_ohlcv(n_symbols, years, seed, end_date=end_date), ignore_index=True)
+
+
+class FakeYahooAPI:
+    """
+    替代 YahooAPI 的本地行情源，不访问网络。
+    """
+
+    def __init__(self, n_symbols, years, seed=0, end_date=None):
+        self.dates = make_dates(years, end_date)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(make_symbols(n_symbols))}
+        self.seed = seed
+        self.prices = {}
+
+    def _symbol_prices(self, symbol):
+        """
+        每只股票的完整日线只生成一次，同一天的价格与请求的日期范围无关，增量下载与全量下载的结果一致。
+        """
+        if symbol not in self.prices:
+            self.prices[symbol] = generate_symbol_prices(symbol, self.symbol_index[symbol], self.dates, self.seed)
+        return self.prices[symbol]
+
+    def get_daily_prices_by_symbols(self, symbols, start_date, end_date):
+        # 与 yfinance 一致，end_date 不包含在内
+        frames = []
+        for symbol in symbols:
+            if symbol not in self.symbol_index:
+                continue
+            df = self._symbol_prices(symbol)
+            frames.append(df[(df['date'] >= pd.Timestamp(start_date)) & (df['date'] < pd.Timestamp(end_date))])
+        frames = [df for df in frames if not df.empty]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def flush_ticker_status():
+        return {}
+
+    @staticmethod
+    def get_quarterly_growth(symbol):
+        return -1, -1
@@ -1,139 +1,453 @@
 from datetime import datetime, timedelta
 from api.yahoo_api import YahooAPI
+from api.ak_share_api import AKSharePriceProvider
 from tickers import Tickers
 from database import mydb
+from database import price_cache
+import indicators
+import backfill
+import trading_calendar
+from indicator_store import IndicatorStore
+from tools.rate_limiter import RateLimiter
+from tools import utils
+from tools.metrics import registry
 import pandas as pd
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 from scipy.stats import linregress
+from scipy.stats import t as t_dist
+
+# 默认更新日线的地区
+REGIONS = ('us', 'cn', 'hk')
+
+# 未指定开始日期时回溯的交易日数：update 约一个月，insert / upsert 约一年
+UPDATE_LOOKBACK_SESSIONS = 21
+INSERT_LOOKBACK_SESSIONS = 252
+
+# 每日刷新 RS rating 的交易日数，覆盖前几天漏跑的情况
+RS_REFRESH_SESSIONS = 5
+
+# 流式计算 200 日均线时向前读取的自然日数，覆盖 200 + 20 个交易日
+STREAMING_LOOKBACK_DAYS = 340
 
 
 class DailyPrices:
-    def __init__(self):
-        self.yahoo_api = YahooAPI()
-        self.tickers = Tickers()
+    def __init__(self, yahoo_api=None, tickers=None, providers=None):
+        """
+        :param providers: {region: 日线数据源}，默认 us 使用 Yahoo，cn / hk 使用 AKShare
+        """
+        self.yahoo_api = yahoo_api if yahoo_api is not None else YahooAPI()
+        self.tickers = tickers if tickers is not None else Tickers()
+        self.providers = {'us': self.yahoo_api}
+        if providers is None:
+            providers = {region: AKSharePriceProvider(region) for region in ('cn', 'hk')}
+        self.providers.update(providers)
+        self._indicator_store = None
+
+    @property
+    def indicator_store(self):
+        # 首次使用时才读取本地状态，并修正与价格表不一致的股票
+        if self._indicator_store is None:
+            store = IndicatorStore.load()
+            store.reconcile()
+            self._indicator_store = store
+        return self._indicator_store
+
+    def get_provider(self, region):
+        if region not in self.providers:
+            raise ValueError(f"Invalid region: '{region}'.")
+        return self.providers[region]
 
     @staticmethod
-    def filter_existing_data(df, symbol, latest_date, mode='realtime'):
-        start_date = '2000-01-01'
-        # 查询数据库中该 symbol 的所有日期
-        existing_dates = mydb.query_daily_stock_prices(symbol, start_date, latest_date, mode)['date'].tolist()
-        df.loc[:, 'date'] = pd.to_datetime(df['date']).dt.date
-        # 过滤掉已经存在的日期
-        return df[~df['date'].isin(existing_dates)]
+    def filter_existing_data(df, mode='realtime'):
+        """
+        剔除数据库中已存在的 (symbol, date) 记录。
 
-    def update_daily_prices_by_symbols(self, symbols, start_date=None, end_date=None, mode='update'):
+        先用一次分组查询取得每只股票的最新日期，晚于最新日期的数据一定是新数据；
+        其余数据再用一次查询取回已存在的日期，做向量化的反连接。
         """
-        更新指定多个 symbols 的每日价格数据，避免插入重复数据。
+        df = df.copy()
+        df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+        symbols = df['symbol'].unique().tolist()
+
+        watermarks = mydb.query_latest_dates_by_symbols(symbols, mode)
+        watermarks['latest_date'] = pd.to_datetime(watermarks['latest_date']).dt.strftime('%Y-%m-%d')
+        latest_date = df['symbol'].map(watermarks.set_index('symbol')['latest_date'])
+
+        # 没有记录或晚于最新日期的数据直接保留
+        is_new = latest_date.isna() | (df['date'] > latest_date)
+        candidates = df[~is_new]
+        if candidates.empty:
+            return df
+
+        existing = mydb.query_existing_dates_by_symbols(candidates['symbol'].unique().tolist(),
+                                                         candidates['date'].min(), candidates['date'].max(), mode)
+        existing['date'] = pd.to_datetime(existing['date']).dt.strftime('%Y-%m-%d')
+
+        # 反连接：只保留数据库中不存在的 (symbol, date)
+        merged = candidates.merge(existing.drop_duplicates(), on=['symbol', 'date'], how='left', indicator=True)
+        missing = merged[merged['_merge'] == 'left_only'].drop(columns='_merge')
+
+        return pd.concat([df[is_new], missing], ignore_index=True)
+
+    def fetch_daily_prices_by_symbols(self, symbols, start_date=None, end_date=None, mode='update', region='us'):
+        """
+        下载指定多个 symbols 的每日价格数据，并剔除已存在的数据，不写入数据库。
 
         :param symbols: 股票代码列表
         :param start_date: 数据开始日期（可选，默认为 None）
         :param end_date: 数据结束日期（可选，默认为当前日期）
-        :param mode: update or insert
+        :param mode: update, insert or upsert
+        :param region: 股票所属地区，决定使用的数据源
+        :return: 待写入的 DataFrame
         """
-        table_name = 'daily_stock_prices_realtime'
-
         # 如果没有提供 end_date，默认为当前日期
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
 
         if start_date is None:
-            if mode == 'update':
-                # 设置为一个月以前
-                start_date_delta = 30
-            else:
-                start_date_delta = 365
-            start_date = (datetime.now() - timedelta(days=start_date_delta)).strftime('%Y-%m-%d')
+            lookback = UPDATE_LOOKBACK_SESSIONS if mode == 'update' else INSERT_LOOKBACK_SESSIONS
+            start_date = trading_calendar.get_calendar(region).sessions_start(lookback, end_date)
 
-        # 从 Yahoo API 获取数据
-        df = self.yahoo_api.get_daily_prices_by_symbols(symbols, start_date, end_date)
+        # 从该地区的数据源获取数据
+        df = self.get_provider(region).get_daily_prices_by_symbols(symbols, start_date, end_date)
 
-        if not df.empty:
-            df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
-
-            if mode == 'update':
-                # 创建一个列表来存储每个符号的数据
-                updated_data = []
-                # 逐个符号处理数据
-                for symbol in symbols:
-                    latest_date = mydb.query_latest_daily_stock_prices(symbol, mode)
-                    if latest_date:
-                        latest_date = latest_date.strftime('%Y-%m-%d')
-                    else:
-                        latest_date = '2000-01-01' if mode == 'history' else (datetime.now() - timedelta(days=365)).strftime(
-                            '%Y-%m-%d')
-
-                    # 过滤已经存在的数据
-                    filtered_df = self.filter_existing_data(df[df['symbol'] == symbol], symbol, latest_date, mode)
-
-                    if not filtered_df.empty:
-                        updated_data.append(filtered_df)
-                if len(updated_data) > 0:
-                    final_df = pd.concat(updated_data, ignore_index=True)
-                else:
-                    final_df = pd.DataFrame()
-            else:
-                final_df = df
-
-            # 合并所有更新的数据
-            if not final_df.empty and len(final_df) > 0:
-                # 移除列索引名称
-                final_df.columns = final_df.columns.rename(None)
+        if df.empty:
+            print(f"No data retrieved for region '{region}'.")
+            return pd.DataFrame()
 
-                try:
-                    mydb.write_df_to_table(final_df, table_name)
-                    print(f"Updated {len(final_df)} rows of data for the batch of symbols.")
-                except Exception as e:
-                    print(f"Error updating data for symbols: {e}")
-            else:
-                print("No new data available for any symbols.")
+        df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+
+        if mode == 'update':
+            # 批量过滤已经存在的数据
+            final_df = self.filter_existing_data(df)
         else:
-            print("No data retrieved from Yahoo API.")
+            final_df = df
+
+        if final_df.empty:
+            print("No new data available for any symbols.")
+            return pd.DataFrame()
 
-    def update_daily_prices(self):
-        tickers = mydb.query_tickers_by_region('us')
-        symbol_list = tickers['symbol'].tolist()  # 获取所有符号
+        # 移除列索引名称
+        final_df.columns = final_df.columns.rename(None)
+        return final_df
+
+    @staticmethod
+    def plan_due_symbols(watermarks, region, end_date, mode='update'):
+        """
+        根据交易日历和每只股票的最新日期，找出有交易日待下载的股票及各自的开始日期。
 
-        # # temp
-        # existed_symbol_list = mydb.find_existed_symbols()['symbol'].tolist()
-        # symbol_list = list(set(symbol_list) - set(existed_symbol_list))
+        有数据的股票从最新日期之后的第一个交易日开始；没有数据的股票按 mode 回溯一定的交易日数；
+        最新日期之后到 end_date 之间没有交易日的股票（周末、节假日）不需要请求数据源。
 
+        :param watermarks: 包含 symbol, latest_date 的 DataFrame，没有数据的股票 latest_date 为空
+        :param end_date: 下载的结束日期（不包含在内）
+        :return: 包含 symbol, latest_date, start_date 的 DataFrame，只含需要下载的股票，按 start_date 排序
+        """
+        calendar = trading_calendar.get_calendar(region)
+        lookback = UPDATE_LOOKBACK_SESSIONS if mode == 'update' else INSERT_LOOKBACK_SESSIONS
+
+        latest = pd.to_datetime(watermarks['latest_date'])
+        has_data = latest.notna().to_numpy()
+        due = np.ones(len(watermarks), dtype=bool)
+        start = np.full(len(watermarks), calendar.sessions_start(lookback, end_date), dtype=object)
+        if has_data.any():
+            due[has_data] = calendar.count_sessions(latest[has_data], end_date) > 0
+            start[has_data] = calendar.next_session(latest[has_data])
+
+        plan = pd.DataFrame({'symbol': watermarks['symbol'].to_numpy(),
+                             'latest_date': latest.dt.strftime('%Y-%m-%d').to_numpy(),
+                             'start_date': start})
+        return plan[due].sort_values(['start_date', 'symbol']).reset_index(drop=True)
 
-        print(f"Updating daily prices for {len(symbol_list)} symbols.")
+    @staticmethod
+    def drop_stored_dates(df, plan):
+        """
+        一批股票共用最早的开始日期下载，剔除每只股票开始日期之前（已存储）的日线。
+        """
+        if df.empty:
+            return df
+        start_date = df['symbol'].map(plan.set_index('symbol')['start_date'])
+        return df[df['date'] >= start_date].reset_index(drop=True)
 
-        # 分组批处理，每批500个tickers
-        for i in range(0, len(symbol_list), 100):
-            print("current index: ", i)
-            batch_symbols = symbol_list[i:i + 100]
-            self.update_daily_prices_by_symbols(batch_symbols, mode='insert')  # 批量更新
-            print(f"Finished updating daily prices for batch: {batch_symbols}.")
-            time.sleep(0.5)  # 控制请求频率
+    def write_daily_prices(self, df, upsert=False):
+        """
+        将价格数据批量写入 daily_stock_prices_realtime 表，返回写入行数。写入成功的日线同时应用到增量指标。
 
-        print("All symbols updated.")
+        :param upsert: 为 True 时已存在的 (symbol, date) 直接覆盖
+        """
+        if df.empty:
+            return 0
+        # 先读取并修正增量状态，再写入新日线
+        store = self.indicator_store
+        rows = mydb.write_df_to_table(df, 'daily_stock_prices_realtime', upsert=upsert)
+        if rows > 0:
+            print(f"Updated {rows} rows of data for the batch of symbols.")
+            store.apply(df)
+            # 较早日期的数据（新股票的历史、补齐的缺口）在下次同步时进入本地价格缓存
+            price_cache.mark_stale(df)
+        else:
+            print("Error updating data for symbols.")
+        return rows
 
-    def update_daily_prices_patch(self):
-        symbols_df = mydb.find_incomplete_symbols()
-        # get symbols as list
-        symbols = symbols_df['symbol'].tolist()
-        mydb.remove_imcomplete_symbols(symbols)
+    @utils.timer(metric='stage_duration_seconds')
+    def update_daily_prices_by_symbols(self, symbols, start_date=None, end_date=None, mode='update', region='us'):
+        """
+        更新指定多个 symbols 的每日价格数据，避免插入重复数据。
 
-        self.update_daily_prices_by_symbols(symbols, mode='insert')
+        :param symbols: 股票代码列表
+        :param start_date: 数据开始日期（可选，默认为 None）
+        :param end_date: 数据结束日期（可选，默认为当前日期）
+        :param mode: update, insert or upsert（upsert 不做写入前的去重查询，直接覆盖已存在的数据）
+        :param region: 股票所属地区
+        """
+        plan = None
+        if start_date is None:
+            # 按交易日历判断，没有待下载的交易日时不请求数据源
+            if end_date is None:
+                end_date = datetime.now().strftime('%Y-%m-%d')
+            watermarks = pd.DataFrame({'symbol': symbols}).merge(mydb.query_latest_dates_by_symbols(symbols),
+                                                                  on='symbol', how='left')
+            plan = self.plan_due_symbols(watermarks, region, end_date, mode)
+            if plan.empty:
+                print(f"No sessions due for {len(symbols)} {region} symbols.")
+                return 0
+            symbols = plan['symbol'].tolist()
+            start_date = plan['start_date'].min()
+
+        final_df = self.fetch_daily_prices_by_symbols(symbols, start_date, end_date, mode, region)
+        if plan is not None:
+            final_df = self.drop_stored_dates(final_df, plan)
+        rows = self.write_daily_prices(final_df, upsert=(mode == 'upsert'))
+        self.indicator_store.save()
+        # 下载中发现的 delisted / invalid 股票一次性写回 tickers 表
+        self.get_provider(region).flush_ticker_status()
+        return rows
+
+    def _write_worker(self, write_queue, stats, upsert=False):
+        """
+        从队列中取出下载好的数据并写入数据库，遇到 None 时退出。
+        单批写入失败时记为失败的股票并继续取数据，写入线程退出后下载线程会阻塞在已满的队列上。
+        """
+        while True:
+            df = write_queue.get()
+            try:
+                if df is None:
+                    return
+                stats['rows'] += self.write_daily_prices(df, upsert)
+            except Exception as e:
+                symbols = sorted(df['symbol'].unique().tolist())
+                stats['failed_symbols'].extend(symbols)
+                print(f"Error writing daily prices for batch {symbols}: {e}")
+            finally:
+                write_queue.task_done()
+
+    def _update_region_prices(self, region, write_queue, batch_size, workers, requests_per_second, mode):
+        """
+        并发下载一个地区所有股票的日线，下载好的数据放入共享的写入队列。
+
+        :return: 该地区的统计信息
+        """
+        start_time = time.perf_counter()
+        end_date = datetime.now().strftime('%Y-%m-%d')
+        watermarks = mydb.query_latest_dates_by_region(region)
+        plan = self.plan_due_symbols(watermarks, region, end_date, mode)
+        symbol_list = plan['symbol'].tolist()
+        up_to_date = len(watermarks) - len(plan)
+        if plan.empty:
+            print(f"No sessions due for {len(watermarks)} {region} symbols, skipping.")
+            return {'symbols': 0, 'up_to_date': up_to_date, 'failed_symbols': [], 'elapsed': 0, 'symbols_per_sec': 0}
+        print(f"Updating daily prices for {len(symbol_list)} {region} symbols ({up_to_date} up to date).")
+
+        # plan 按开始日期排序，同一批股票的开始日期相近
+        batches = [plan.iloc[i:i + batch_size] for i in range(0, len(plan), batch_size)]
+        limiter = RateLimiter(requests_per_second, capacity=workers)
+
+        def download(batch):
+            limiter.acquire()  # 控制请求频率
+            df = self.fetch_daily_prices_by_symbols(batch['symbol'].tolist(), batch['start_date'].min(), end_date,
+                                                    mode=mode, region=region)
+            df = self.drop_stored_dates(df, batch)
+            if not df.empty:
+                write_queue.put(df)
+
+        failed_symbols = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(download, batch): batch['symbol'].tolist() for batch in batches}
+            for future in as_completed(futures):
+                batch_symbols = futures[future]
+                try:
+                    future.result()
+                    print(f"Finished updating daily prices for {region} batch: {batch_symbols}.")
+                except Exception as e:
+                    failed_symbols.extend(batch_symbols)
+                    print(f"Error updating daily prices for {region} batch {batch_symbols}: {e}")
+
+        # 下载中发现的 delisted / invalid 股票一次性写回 tickers 表
+        self.get_provider(region).flush_ticker_status()
+
+        elapsed = time.perf_counter() - start_time
+        symbols_per_sec = len(symbol_list) / elapsed if elapsed > 0 else 0
+        print(f"Region '{region}' downloaded. {len(symbol_list)} symbols in {elapsed:.1f}s "
+              f"({symbols_per_sec:.1f} symbols/sec).")
+        registry.gauge('ingest_symbols_per_second', 'Symbols ingested per second in the last run').set(
+            symbols_per_sec, region=region)
+        registry.counter('ingest_failed_symbols_total').inc(len(failed_symbols), region=region)
+        return {
+            'symbols': len(symbol_list),
+            'up_to_date': up_to_date,
+            'failed_symbols': failed_symbols,
+            'elapsed': elapsed,
+            'symbols_per_sec': symbols_per_sec
+        }
+
+    @utils.timer(metric='stage_duration_seconds')
+    def update_daily_prices(self, regions=REGIONS, batch_size=100, workers=4, requests_per_second=2.0, queue_size=8,
+                            mode='insert'):
+        """
+        并发更新各地区股票的每日价格。
+
+        每个地区在独立的线程中下载，使用各自的数据源和限流器，一个地区变慢不影响其他地区；
+        所有地区下载好的数据进入同一个写入队列，由一个写入线程批量入库。
+
+        :param regions: 需要更新的地区
+        :param batch_size: 每批下载的 symbols 数量
+        :param workers: 每个地区同时下载的批次数
+        :param requests_per_second: 每个地区的批次请求速率上限
+        :param queue_size: 写入队列的容量，队列满时下载线程等待写入
+        :param mode: update, insert or upsert
+        :return: 本次运行的统计信息
+        """
+        start_time = time.perf_counter()
+        write_queue = queue.Queue(maxsize=queue_size)
+        stats = {'rows': 0, 'failed_symbols': []}
+
+        # 写入线程与下载线程并行，下载和入库互不等待
+        writer = threading.Thread(target=self._write_worker, args=(write_queue, stats, mode == 'upsert'),
+                                  daemon=True)
+        writer.start()
+
+        region_stats = {}
+        with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+            futures = {executor.submit(self._update_region_prices, region, write_queue, batch_size, workers,
+                                       requests_per_second, mode): region for region in regions}
+            for future in as_completed(futures):
+                region = futures[future]
+                try:
+                    region_stats[region] = future.result()
+                except Exception as e:
+                    region_stats[region] = {'symbols': 0, 'failed_symbols': [], 'error': repr(e)}
+                    print(f"Error updating daily prices for region '{region}': {e}")
+
+        write_queue.put(None)
+        writer.join()
+        self.indicator_store.save()
+
+        # 将新日期追加到本地价格缓存
+        price_cache.sync()
+
+        elapsed = time.perf_counter() - start_time
+        symbols = sum(region['symbols'] for region in region_stats.values())
+        failed_symbols = [symbol for region in region_stats.values() for symbol in region['failed_symbols']]
+        failed_symbols += stats['failed_symbols']
+        symbols_per_sec = symbols / elapsed if elapsed > 0 else 0
+        print(f"All symbols updated. {symbols} symbols, {stats['rows']} rows "
+              f"in {elapsed:.1f}s ({symbols_per_sec:.1f} symbols/sec).")
+        registry.gauge('ingest_rows_per_second', 'Rows ingested per second in the last run').set(
+            stats['rows'] / elapsed if elapsed > 0 else 0)
+        utils.export_metrics()
+
+        return {
+            'symbols': symbols,
+            'rows': stats['rows'],
+            'failed_symbols': failed_symbols,
+            'elapsed': elapsed,
+            'symbols_per_sec': symbols_per_sec,
+            'regions': region_stats
+        }
+
+    @utils.timer(metric='stage_duration_seconds')
+    def update_daily_prices_patch(self, regions=REGIONS, batch_size=100):
+        """
+        补齐 realtime 表中缺失的日线：按交易日历和 ipo_date 计算每只股票的缺失区间（见 backfill），
+        缺失区间相同的股票合并下载，只写入缺失的日线，不删除已有数据。
+
+        :param regions: 需要修补的地区
+        :param batch_size: 每次请求的 symbols 数量
+        :return: 写入的行数
+        """
+        rows = 0
+        patched_symbols = set()
+        for region in regions:
+            for request in backfill.plan_backfill(region, batch_size=batch_size):
+                df = self.fetch_daily_prices_by_symbols(request['symbols'], request['start_date'],
+                                                        request['end_date'], mode='update', region=region)
+                written = self.write_daily_prices(df)
+                if written > 0:
+                    rows += written
+                    patched_symbols.update(df['symbol'].unique())
+            self.get_provider(region).flush_ticker_status()
+
+        if len(patched_symbols) > 0:
+            # 补入的是较早的日期，同步本地价格缓存（已由 write_daily_prices 标记），重建这些股票的增量指标
+            price_cache.sync()
+            self.indicator_store.rebuild(sorted(patched_symbols))
+        self.indicator_store.save()
+        print(f"Patched {rows} rows for {len(patched_symbols)} symbols.")
+        return rows
 
     @staticmethod
-    def update_moving_averages():
+    @utils.timer(metric='stage_duration_seconds')
+    def rollover_prices(sessions=mydb.REALTIME_SESSIONS):
         """
-            批量更新所有股票的均线数据。
-            """
-        # 批量计算均线
-        result_df = mydb.calculate_moving_averages_batch()
-        print(f"Updating {len(result_df)} rows of moving averages.")
+        realtime 表只保留每个地区最近 sessions 个交易日，更早的数据移入 history 表，本地价格缓存同步裁剪。
+        缓存按月分区且不区分地区，按最早的截止日期裁剪。
+        """
+        cutoffs, rows = mydb.rollover_realtime_prices(sessions)
+        if len(cutoffs) > 0:
+            price_cache.prune(min(cutoffs.values()))
+        return rows
 
-        # 将结果写入 daily_stock_moving_averages 表
-        if not result_df.empty:
-            mydb.truncate_table('daily_stock_moving_averages')
-            mydb.write_df_to_table(result_df, 'daily_stock_moving_averages')
+    @utils.timer(metric='stage_duration_seconds')
+    def update_moving_averages(self, full=False):
+        """
+        更新所有活跃股票的均线数据。
+
+        默认只替换上次更新后有新日线的股票，耗时与新日线数量成正比；
+        首次运行（没有增量状态）、大部分股票缺少历史状态或 full 为 True 时从价格表重建并刷新整张表。
+        """
+        store = self.indicator_store
+        active_symbols = set(mydb.query_all_tickers()['symbol'])
+        new_symbols = store.new_symbols()
+
+        if full or store.is_empty() or len(new_symbols) > len(active_symbols) / 2:
+            store.rebuild()
+            result_df = store.snapshot(sorted(active_symbols))
+            print(f"Updating {len(result_df)} rows of moving averages.")
+            if not result_df.empty:
+                rows = mydb.refresh_table_atomically(result_df, 'daily_stock_moving_averages')
+                # 刷新失败时保留脏标记，下次运行重试
+                if rows != len(result_df):
+                    raise RuntimeError(f"Refresh of daily_stock_moving_averages failed, "
+                                       f"{rows} of {len(result_df)} rows written.")
+        else:
+            # 新出现的股票先从价格表补齐历史状态
+            if len(new_symbols) > 0:
+                store.rebuild(new_symbols)
+            dirty_symbols = store.dirty_symbols()
+            result_df = store.snapshot([symbol for symbol in dirty_symbols if symbol in active_symbols])
+            print(f"Updating {len(result_df)} rows of moving averages.")
+            mydb.replace_moving_averages(result_df)
+            mydb.remove_inactive_moving_averages()
+
+        store.clear_dirty()
+        store.save()
 
     @staticmethod
+    @utils.timer(metric='stage_duration_seconds')
     def mark_invalid_tickers():
         """
         标记所有inactive and exclude的股票。
@@ -142,52 +456,63 @@ class DailyPrices:
         mydb.update_exclude_tickers()
 
     @staticmethod
+    @utils.timer(metric='stage_duration_seconds')
     def save_screening_output():
         df = mydb.apply_sql_filter()
         if not df.empty:
             print(f"{len(df)} rows inserted!")
-            mydb.truncate_table('screening_output')
-            mydb.write_df_to_table(df, 'screening_output')
+            mydb.refresh_table_atomically(df, 'screening_output')
 
     @staticmethod
-    def calculate_rsr(df, price_col='close', period=14):
+    @utils.timer(metric='stage_duration_seconds')
+    def update_rs_ratings(sessions=RS_REFRESH_SESSIONS):
         """
-        计算相对动力排名 (Relative Strength Ranking, RSR)
-
-        参数:
-        - df: 包含价格数据的 DataFrame
-        - price_col: 股票价格列名
-        - period: 计算 RSR 的时间周期
-
-        返回:
-        - DataFrame: 包含 RSR 值的 DataFrame
+        计算最近 sessions 个交易日全部活跃股票的 RS rating，并写入 daily_stock_rs_ratings 表。
         """
-        # 计算过去一段时间的平均价格
-        df['rolling_mean'] = df[price_col].rolling(window=period).mean()
-
-        # 计算 RS
-        df['rs'] = df[price_col] / df['rolling_mean']
-
-        # 将 RS 标准化到 0-100 范围
-        df['rsr'] = (df['rs'] - df['rs'].min()) / (df['rs'].max() - df['rs'].min()) * 100
-
-        # 清理临时列
-        df.drop(columns=['rolling_mean', 'rs'], inplace=True)
-
-        return df
+        result_df = indicators.calculate_rs_ratings(sessions)
+        print(f"Updating {len(result_df)} rows of RS ratings.")
+        if not result_df.empty:
+            mydb.write_df_to_table(result_df, 'daily_stock_rs_ratings', upsert=True)
 
     @staticmethod
-    def calculate_sma():
-        df = mydb.get_screening_results()
-
+    def _add_sma(df, window=200):
         df = df.sort_values(['symbol', 'date']).reset_index(drop=True)
 
-        df['ma_200'] = df.groupby('symbol')['close'].transform(
-            lambda x: x.rolling(200, min_periods=200).mean()
+        df['ma_200'] = df.groupby('symbol', observed=True)['close'].transform(
+            lambda x: x.rolling(window, min_periods=window).mean()
         )
         df = df[df['ma_200'].notna()]
         return df
 
+    def calculate_sma(self, streaming=False, start_date=None, tail=None):
+        """
+        计算筛选结果的 200 日均线。
+
+        :param streaming: 为 True 时按 symbol 分块流式读取并计算，内存占用与股票数量无关
+        :param start_date: 只读取该日期之后的数据（可选，需预留 200 天的计算窗口）
+        :param tail: 每个 symbol 只保留最近 tail 天的结果（可选）
+        """
+        # 200 日均线是第一步筛选，候选为 screening_output 中的全部股票，不受上次运行留下的标记影响
+        if not streaming:
+            df = price_cache.get_screening_results(exact=False)
+            if start_date is not None:
+                df = df[pd.to_datetime(df['date']) >= pd.Timestamp(start_date)]
+            df = self._add_sma(df)
+            return df.groupby('symbol').tail(tail) if tail is not None else df
+
+        results = []
+        for chunk in mydb.iter_screening_results(start_date=start_date, exact=False):
+            chunk = self._add_sma(chunk)
+            if tail is not None:
+                chunk = chunk.groupby('symbol', observed=True).tail(tail)
+            results.append(chunk)
+
+        if len(results) == 0:
+            return pd.DataFrame(columns=['date', 'symbol', 'close', 'volume', 'open', 'high', 'low', 'ma_200'])
+        df = pd.concat(results, ignore_index=True)
+        df['symbol'] = df['symbol'].astype(str)
+        return df
+
     @staticmethod
     def check_slope_trend(group):
         if len(group) < 20:  # 确保每个symbol有足够数据
@@ -201,21 +526,67 @@ class DailyPrices:
             'trend': (slope > 0) & (p_value < 0.05)  # 斜率正且显著
         })
 
-    def apply_ma_200_up_trend_filter(self, p_value_threshold=0.05):
-        df = self.calculate_sma()
-
-        # 获取每个symbol最近20天的数据
-        recent_sma = df.groupby('symbol').tail(20)
+    @staticmethod
+    def calculate_slopes(df, value_col='ma_200', window=20):
+        """
+        用闭式最小二乘一次性计算所有 symbol 最近 window 天 value_col 的斜率和 p-value，
+        结果与逐个调用 scipy.stats.linregress 一致。
 
-        # 计算每个symbol的ma_200斜率和p-value
-        def calculate_slope(group):
-            x = np.arange(len(group))  # 时间序列
-            y = group['ma_200'].values  # ma_200 值
-            slope, intercept, r_value, p_value, std_err = linregress(x, y)
-            return pd.Series({'slope': slope, 'p_value': p_value})
+        :param df: 包含 symbol, date 和 value_col 的 DataFrame
+        :return: 包含 symbol, slope, p_value 的 DataFrame
+        """
+        df = df.sort_values(['symbol', 'date'])
+        recent = df.groupby('symbol').tail(window)
+
+        # 组成 symbols × window 的矩阵，数据不足 window 天的 symbol 右侧为空
+        codes, symbols = pd.factorize(recent['symbol'], sort=True)
+        position = recent.groupby('symbol').cumcount().to_numpy()
+        y = np.full((len(symbols), window), np.nan)
+        y[codes, position] = recent[value_col].to_numpy(dtype='float64')
+
+        mask = ~np.isnan(y)
+        n = mask.sum(axis=1)
+        x = np.broadcast_to(np.arange(window, dtype='float64'), y.shape)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_mean = np.where(mask, x, 0).sum(axis=1) / n
+            y_mean = np.where(mask, y, 0).sum(axis=1) / n
+            dx = np.where(mask, x - x_mean[:, None], 0)
+            dy = np.where(mask, y - y_mean[:, None], 0)
+
+            # 与 linregress 相同的有偏协方差
+            ssxm = (dx * dx).sum(axis=1) / n
+            ssxym = (dx * dy).sum(axis=1) / n
+            ssym = (dy * dy).sum(axis=1) / n
+
+            r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
+            r = np.where((ssxm == 0) | (ssym == 0), np.where(ssxym == 0, np.nan, 0.0), r)
+            slope = ssxym / ssxm
+
+            # t 统计量与双侧 p-value
+            dof = n - 2
+            tiny = 1.0e-20
+            t_stat = r * np.sqrt(dof / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+            p_value = 2 * t_dist.sf(np.abs(t_stat), dof)
+
+        # 只有两个点时与 linregress 的处理方式一致
+        two_points = n == 2
+        p_value[two_points] = np.where(y[two_points, 0] == y[two_points, 1], 1.0, 0.0)
+        p_value[n < 2] = np.nan
+
+        return pd.DataFrame({'symbol': symbols, 'slope': slope, 'p_value': p_value})
+
+    @utils.timer(metric='stage_duration_seconds')
+    def apply_ma_200_up_trend_filter(self, p_value_threshold=0.05, streaming=False):
+        if streaming:
+            # 只读取计算最近 20 天 200 日均线所需的数据
+            start_date = (datetime.now() - timedelta(days=STREAMING_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+            df = self.calculate_sma(streaming=True, start_date=start_date, tail=20)
+        else:
+            df = self.calculate_sma()
 
-        # 对每个symbol计算斜率和p-value
-        slope_pvalue_df = recent_sma.groupby('symbol').apply(calculate_slope).reset_index()
+        # 对每个symbol最近20天的ma_200计算斜率和p-value
+        slope_pvalue_df = self.calculate_slopes(df, 'ma_200', 20)
 
         # 筛选出斜率显著为正的symbol
         up_trend_symbols = slope_pvalue_df[
@@ -223,8 +594,8 @@ class DailyPrices:
             ]['symbol'].tolist()
 
         print("符合200日均线上升趋势股票数量:", len(up_trend_symbols))
-        if len(up_trend_symbols) > 0:
-            mydb.update_ma_200_up_trend(up_trend_symbols)
+        # 即使没有符合条件的股票也要更新，以重置上次运行遗留的标记
+        mydb.update_ma_200_up_trend(up_trend_symbols)
 
     @staticmethod
     def detect_cup_with_handle(df, cup_duration=20, handle_duration=5, cup_depth=0.15, handle_depth=0.08):
@@ -280,6 +651,101 @@ class DailyPrices:
 
         return True
 
+    @staticmethod
+    def detect_cup_with_handle_batch(df, cup_duration=20, handle_duration=5, cup_depth=0.15, handle_depth=0.08,
+                                     lookback=60):
+        """
+        对所有 symbol 同时识别杯柄形态，判断结果与 detect_cup_with_handle 一致。
+
+        每个 symbol 最近 lookback 天的数据按日期倒序排成 symbols × lookback 的矩阵（位置 0 为最新一天），
+        杯底、杯顶、柄部及交易量指标均用数组运算一次算出。
+
+        :param df: 包含 symbol, date, close, volume 的 DataFrame
+        :return: 每个 symbol 一行，包含 cup_with_handle 判断结果和形态参数
+        """
+        df = df.sort_values(['symbol', 'date'], ascending=[True, False])
+        recent = df.groupby('symbol').head(lookback)
+
+        codes, symbols = pd.factorize(recent['symbol'], sort=True)
+        position = recent.groupby('symbol').cumcount().to_numpy()
+        rows = np.arange(len(symbols))
+
+        close = np.full((len(symbols), lookback), np.nan)
+        volume = np.full((len(symbols), lookback), np.nan)
+        close[codes, position] = recent['close'].to_numpy(dtype='float64')
+        volume[codes, position] = recent['volume'].to_numpy(dtype='float64')
+
+        length = np.bincount(codes, minlength=len(symbols))
+        index = np.arange(lookback)
+        has_close = ~np.isnan(close)
+        valid = has_close.any(axis=1)
+
+        # 最近的杯底（全局最低点，相同取最新的一天）
+        cup_bottom = np.where(has_close, close, np.inf).argmin(axis=1)
+        # 杯顶：杯底右侧（倒序索引 0 ~ cup_bottom）的最高点
+        in_cup = has_close & (index <= cup_bottom[:, None])
+        cup_top = np.where(in_cup, close, -np.inf).argmax(axis=1)
+        # 柄部低点：杯顶右侧（倒序索引 0 ~ cup_top）的最低点
+        in_handle = has_close & (index <= cup_top[:, None])
+        handle_end = np.where(in_handle, close, np.inf).argmin(axis=1)
+
+        bottom_close = close[rows, cup_bottom]
+        top_close = close[rows, cup_top]
+        handle_close = close[rows, handle_end]
+
+        # 杯部与柄部参数
+        cup_length = cup_bottom - cup_top
+        handle_length = cup_top - handle_end
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cup_retracement = (top_close - bottom_close) / top_close
+            handle_retracement = (top_close - handle_close) / top_close
+
+        is_cup = ~((cup_length < cup_duration) | (cup_retracement > cup_depth))
+        is_handle = ~((handle_length < handle_duration) | (handle_retracement > handle_depth))
+
+        # --- 动态交易量阈值 ---
+        with np.errstate(divide='ignore', invalid='ignore'):
+            volume_change = volume[:, 1:] / volume[:, :-1] - 1
+            change_count = (~np.isnan(volume_change)).sum(axis=1)
+            vol_volatility = np.full(len(symbols), np.nan)
+            enough = change_count > 1
+            vol_volatility[enough] = np.nanstd(volume_change[enough], axis=1, ddof=1)
+        breakout_multiplier = 1.2 + 0.3 * vol_volatility
+        cup_volume_ratio = 0.7 - 0.2 * vol_volatility
+
+        # 区间均值：用前缀和计算闭区间 [start, end] 内交易量的均值（忽略空值）
+        volume_sum = np.concatenate([np.zeros((len(symbols), 1)), np.nan_to_num(volume).cumsum(axis=1)], axis=1)
+        volume_count = np.concatenate([np.zeros((len(symbols), 1)), (~np.isnan(volume)).cumsum(axis=1)], axis=1)
+
+        def range_mean(start, end):
+            total = volume_sum[rows, end + 1] - volume_sum[rows, start]
+            count = volume_count[rows, end + 1] - volume_count[rows, start]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return total / count
+
+        cup_volume = range_mean(np.maximum(0, cup_bottom - 5), np.minimum(length - 1, cup_bottom + 5))
+        handle_volume = range_mean(handle_end, cup_top)
+        breakout_volume = volume[rows, handle_end]
+
+        return pd.DataFrame({
+            'symbol': symbols,
+            'cup_with_handle': valid & is_cup & is_handle,
+            'cup_bottom': cup_bottom,
+            'cup_top': cup_top,
+            'cup_length': cup_length,
+            'cup_retracement': cup_retracement,
+            'handle_end': handle_end,
+            'handle_length': handle_length,
+            'handle_retracement': handle_retracement,
+            'vol_volatility': vol_volatility,
+            'breakout_multiplier': breakout_multiplier,
+            'cup_volume_ratio': cup_volume_ratio,
+            'cup_volume': cup_volume,
+            'handle_volume': handle_volume,
+            'breakout_volume': breakout_volume
+        })
+
+    @utils.timer(metric='stage_duration_seconds')
     def apply_cup_with_handle_symbols_filter(self):
         """
         找到符合杯柄形态的股票符号。
@@ -287,67 +753,38 @@ class DailyPrices:
         :param df: 包含日期、收盘价和交易量的 DataFrame
         :return: 符合条件的股票符号列表
         """
-        df = mydb.get_screening_results(ma_200_up_trend=True, profit_up_trend=True)
+        # 候选只看前置标记，重复运行时上次已标记杯柄的股票仍参与检测
+        df = price_cache.get_screening_results(ma_200_up_trend=True, profit_up_trend=True, exact=False)
         print(len(df['symbol'].unique().tolist()))
-        symbols_with_cup = []
 
-        # 按 symbol 分组并检测
-        for symbol, group in df.groupby('symbol'):
-            if self.detect_cup_with_handle(group):
-                symbols_with_cup.append(symbol)
+        # 所有 symbol 一次性检测
+        result = self.detect_cup_with_handle_batch(df)
+        symbols_with_cup = result.loc[result['cup_with_handle'], 'symbol'].tolist()
         print("symbols with cup", symbols_with_cup)
         print("len of symbols", len(symbols_with_cup))
 
-        if len(symbols_with_cup) > 0:
-            mydb.update_cup_with_handle(symbols_with_cup)
+        # 即使没有符合条件的股票也要更新，以重置上次运行遗留的标记
+        mydb.update_cup_with_handle(symbols_with_cup)
 
+    @utils.timer(metric='stage_duration_seconds')
     def apply_profit_up_trend_filter(self):
-        df = mydb.get_screening_results(ma_200_up_trend=True)
+        df = price_cache.get_screening_results(ma_200_up_trend=True, exact=False)
         symbols_list = df['symbol'].unique().tolist()
 
-        filtered_symbols = []
-        for symbol in symbols_list:
+        # 获取最新季度的利润同比增长，本地缓存未命中的并发下载
+        growth_results = self.yahoo_api.get_quarterly_growth_batch(symbols_list)
 
-            current_net_income, growth = self.yahoo_api.get_quarterly_growth(symbol)  # 获取最新季度的利润同比增长
+        filtered_symbols = []
+        for symbol, (current_net_income, growth) in growth_results.items():
             if (growth > 20) and (current_net_income > 0):  # 过滤条件：同比增长必须大于20%
                 filtered_symbols.append(symbol)
 
         print("符合200日均线上升趋势且利润同比增长大于20%的股票数量:", len(filtered_symbols))
-        if len(filtered_symbols) > 0:
-            mydb.update_profit_up_trend(filtered_symbols)
+        # 即使没有符合条件的股票也要更新，以重置上次运行遗留的标记
+        mydb.update_profit_up_trend(filtered_symbols)
 
     def apply_final_filter(self):
         self.apply_ma_200_up_trend_filter()
-        # df = self.calculate_sma()
-        # recent_sma = df.groupby('symbol').tail(20)
-        #
-        # result = recent_sma.groupby('symbol').apply(self.check_slope_trend).reset_index()
-        #
-        # qualified_symbols = result[result['trend']]['symbol'].tolist()
-        #
-        # print("符合200日均线上升趋势股票数量:", len(qualified_symbols))
-        #
-        # # 过滤符合条件的股票
-        # filtered_symbols = []
-        # for symbol in qualified_symbols:
-        #     print(symbol)
-        #     growth = self.yahoo_api.get_quarterly_growth(symbol)  # 获取最新季度的利润同比增长
-        #     if growth > 20:  # 过滤条件：同比增长必须大于20%
-        #         filtered_symbols.append(symbol)
-        #
-        # print("符合200日均线上升趋势且利润同比增长大于20%的股票数量:", len(filtered_symbols))
-        # return filtered_symbols
-
-        # # 根据 qualified_symbols 过滤原始 DataFrame
-        # filtered_df = df[df['symbol'].isin(qualified_symbols)]
-        #
-        # # 计算 RSR
-        # filtered_df = self.calculate_rsr(filtered_df)
-        #
-        # # 根据 RSR 进行最后一次过滤
-        # final_filtered_df = filtered_df[filtered_df['rsr'] >= 70]
-        # print("最终符合条件的股票数量:", len(final_filtered_df))
-        # print("最终符合条件的股票：", final_filtered_df['symbol'].unique().tolist())
 
 
 if __name__ == '__main__':
@@ -1,10 +1,15 @@
 import pandas as pd
 from sqlalchemy import create_engine
+from sqlalchemy import bindparam
 from sqlalchemy import text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 import configparser as cp
 import logging
 import os
+import tempfile
+import time
 from tools import utils
+from tools.metrics import registry
 
 #####################################
 # Database access module for stock code table and stock daily K line table
@@ -34,13 +39,46 @@ exclude_keywords = [
             'income'  # 收益型基金
         ]
 
+# screening_output 中的筛选标记列
+SCREENING_FLAGS = ('ma_200_up_trend', 'profit_up_trend', 'cup_with_handle')
+
+# mode 对应的价格表，all 为 realtime 与 history 的合并视图
+PRICE_TABLES = {
+    'realtime': 'daily_stock_prices_realtime',
+    'history': 'daily_stock_prices_history',
+    'all': 'daily_stock_prices_all'
+}
+
+# realtime 表保留的交易日数，更早的数据移入 history 表
+# 需覆盖 200 日均线和 52 周最高/最低（252 个交易日）所需的窗口
+REALTIME_SESSIONS = 300
+
+# 多行 INSERT 每条语句的行数
+WRITE_CHUNK_SIZE = 2000
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.propagate = False
+
 
 class Database:
     def __init__(self):
         self.engine = self._create_engine()
+        # LOAD DATA LOCAL INFILE 专用的连接池，首次批量导入时才创建
+        self.bulk_engine = None
 
     @staticmethod
-    def _create_engine():
+    def _create_engine(local_infile=False):
+        """
+        :param local_infile: 为 True 时允许 LOAD DATA LOCAL INFILE，只用于批量导入的连接池
+        """
+        # 指定 STOCK_WIZARD_DB_URL 时使用该数据库（如基准测试使用的本地 SQLite）
+        db_url = os.environ.get('STOCK_WIZARD_DB_URL')
+        if db_url:
+            return create_engine(db_url)
+
         config = cp.ConfigParser()
         config_path = os.path.join(utils.get_root_path(), 'config', 'stock.config')
         config.read(config_path, encoding='utf-8-sig')
@@ -51,22 +89,33 @@ class Database:
         port = config.get('DB', 'port')
         database = config.get('DB', 'database')
 
-        return create_engine(
-            'mysql+pymysql://{}:{}@{}:{}/{}'.format(user, password, host, port, database),
-            pool_size=20,
-            max_overflow=50,
-            pool_recycle=30
-        )
+        url = 'mysql+pymysql://{}:{}@{}:{}/{}'.format(user, password, host, port, database)
+        if local_infile:
+            return create_engine(url, pool_size=2, max_overflow=2, pool_recycle=30,
+                                 connect_args={'local_infile': True})
+        return create_engine(url, pool_size=20, max_overflow=50, pool_recycle=30)
 
     def get_connection(self):
         return self.engine
 
+    def get_bulk_connection(self):
+        if self.bulk_engine is None:
+            self.bulk_engine = self._create_engine(local_infile=True)
+        return self.bulk_engine
+
 
 # 实例化数据库连接
 db = Database()
 
 
+def price_table(mode='realtime'):
+    if mode not in PRICE_TABLES:
+        raise ValueError(f"Invalid mode: '{mode}'.")
+    return PRICE_TABLES[mode]
+
+
 # query full stock list from DB
+@utils.timer(metric='db_query_duration_seconds')
 def query_all_tickers():
     engine = db.get_connection()
     sql = "select * from tickers where status='Active';"
@@ -74,17 +123,23 @@ def query_all_tickers():
     return df
 
 
-def query_tickers_by_region(region):
+@utils.timer(metric='db_query_duration_seconds')
+def query_tickers_by_region(region, active_only=True):
+    """
+    :param active_only: 为 False 时返回该地区所有状态的股票
+    """
     engine = db.get_connection()
-    sql = "select * from tickers where region = '{}' and status='Active';".format(region)
+    sql = "select * from tickers where region = '{}'".format(region)
+    if active_only:
+        sql += " and status='Active'"
+    sql += ";"
     df = pd.read_sql_query(sql, engine)
     return df
 
 
+@utils.timer(metric='db_query_duration_seconds')
 def query_daily_stock_prices(symbol, start_date, end_date, mode='realtime'):
-    table_name = 'daily_stock_prices_realtime'
-    if mode == 'history':
-        table_name = 'daily_stock_prices_history'
+    table_name = price_table(mode)
 
     if start_date is None:
         start_date = '2000-01-01'  # 默认从 2000-01-01 开始获取数据
@@ -95,15 +150,14 @@ def query_daily_stock_prices(symbol, start_date, end_date, mode='realtime'):
     return df
 
 
+@utils.timer(metric='db_query_duration_seconds')
 def query_latest_daily_stock_prices(symbol, mode='realtime'):
     """
     查询某只股票的最新日期。
     """
     engine = db.get_connection()
 
-    table_name = 'daily_stock_prices_realtime'
-    if mode == 'history':
-        table_name = 'daily_stock_prices_history'
+    table_name = price_table(mode)
 
     sql = f"""
     SELECT MAX(date) AS latest_date
@@ -114,107 +168,501 @@ def query_latest_daily_stock_prices(symbol, mode='realtime'):
     return result['latest_date'].iloc[0] if not result.empty else None
 
 
-def calculate_moving_averages_batch():
+@utils.timer(metric='db_query_duration_seconds')
+def query_latest_dates_by_symbols(symbols, mode='realtime'):
     """
-    批量计算所有股票的均线。
+    一次查询多只股票的最新日期。
     """
+    table_name = price_table(mode)
+
+    if len(symbols) == 0:
+        return pd.DataFrame(columns=['symbol', 'latest_date'])
+
     engine = db.get_connection()
-    sql = """
-       SELECT
-    lp.symbol,
-    lp.date,
-    lp.close as current_price,
-    (SELECT AVG(close)
-     FROM (
-         SELECT close
-         FROM daily_stock_prices_realtime
-         WHERE symbol = lp.symbol AND date <= lp.date
-         ORDER BY date DESC
-         LIMIT 50
-     ) AS last_50_days) AS ma_50,
-    (SELECT AVG(close)
-     FROM (
-         SELECT close
-         FROM daily_stock_prices_realtime
-         WHERE symbol = lp.symbol AND date <= lp.date
-         ORDER BY date DESC
-         LIMIT 150
-     ) AS last_150_days) AS ma_150,
-    (SELECT AVG(close)
-     FROM (
-         SELECT close
-         FROM daily_stock_prices_realtime
-         WHERE symbol = lp.symbol AND date <= lp.date
-         ORDER BY date DESC
-         LIMIT 200
-     ) AS last_200_days) AS ma_200,
-     (SELECT MAX(close)
-     FROM daily_stock_prices_realtime
-     WHERE symbol = lp.symbol) AS high_of_52weeks,
-    (SELECT MIN(close)
-     FROM daily_stock_prices_realtime
-     WHERE symbol = lp.symbol) AS low_of_52weeks
-FROM (
-    SELECT
-        dsp.symbol,
-        dsp.date,
-        dsp.close
-    FROM
-        daily_stock_prices_realtime dsp
+    symbols = ', '.join(f"'{symbol}'" for symbol in symbols)
+    sql = f"""
+    SELECT symbol, MAX(date) AS latest_date
+    FROM {table_name}
+    WHERE symbol IN ({symbols})
+    GROUP BY symbol;
+    """
+    return pd.read_sql_query(sql, engine)
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_latest_dates(mode='realtime'):
+    """
+    一次查询所有股票的最新日期。
+    """
+    table_name = price_table(mode)
+
+    engine = db.get_connection()
+    sql = f"""
+    SELECT symbol, MAX(date) AS latest_date
+    FROM {table_name}
+    GROUP BY symbol;
+    """
+    return pd.read_sql_query(sql, engine)
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_latest_dates_by_region(region, mode='realtime'):
+    """
+    一次查询某个地区所有活跃股票的最新日期，没有数据的股票 latest_date 为空。
+    """
+    table_name = price_table(mode)
+
+    engine = db.get_connection()
+    sql = f"""
+    SELECT t.symbol, MAX(dsp.date) AS latest_date
+    FROM tickers AS t
+    LEFT JOIN {table_name} AS dsp ON dsp.symbol = t.symbol
+    WHERE t.region = '{region}' AND t.status = 'Active'
+    GROUP BY t.symbol;
+    """
+    return pd.read_sql_query(sql, engine)
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_existing_dates_by_symbols(symbols, start_date, end_date, mode='realtime'):
+    """
+    一次查询多只股票在指定日期区间内已存在的 (symbol, date)。
+    """
+    table_name = price_table(mode)
+
+    if len(symbols) == 0:
+        return pd.DataFrame(columns=['symbol', 'date'])
+
+    engine = db.get_connection()
+    symbols = ', '.join(f"'{symbol}'" for symbol in symbols)
+    sql = f"""
+    SELECT symbol, date
+    FROM {table_name}
+    WHERE symbol IN ({symbols}) AND date BETWEEN '{start_date}' AND '{end_date}';
+    """
+    return pd.read_sql_query(sql, engine)
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_active_close_prices(start_date=None, symbols=None):
+    """
+    一次性读取所有活跃股票的日线收盘价和所属地区，供均线和 RS rating 计算使用。
+
+    :param symbols: 只读取这些股票（可选）
+    """
+    if start_date is None:
+        start_date = '2000-01-01'
+    symbol_condition = ""
+    if symbols is not None:
+        if len(symbols) == 0:
+            return pd.DataFrame(columns=['symbol', 'date', 'close', 'region'])
+        symbol_condition = "AND dsp.symbol IN ({})".format(', '.join(f"'{symbol}'" for symbol in symbols))
+    engine = db.get_connection()
+    sql = f"""
+    SELECT dsp.symbol, dsp.date, dsp.close, t.region
+    FROM daily_stock_prices_realtime AS dsp
     JOIN tickers AS t ON dsp.symbol = t.symbol
-    WHERE
-        t.status = 'Active'
-        AND dsp.date = (SELECT MAX(date) FROM daily_stock_prices_realtime WHERE symbol = dsp.symbol)
-) AS lp
-ORDER BY
-    lp.symbol;
-        """
+    WHERE t.status = 'Active' AND dsp.date >= '{start_date}' {symbol_condition}
+    ORDER BY dsp.symbol, dsp.date;
+    """
     return pd.read_sql_query(sql, engine)
 
 
-def apply_sql_filter():
+@utils.timer(metric='db_query_duration_seconds')
+def apply_sql_filter(min_rs_rating=None):
+    """
+    :param min_rs_rating: 设置时只保留同一交易日 RS rating 不低于该值的股票（需先更新 daily_stock_rs_ratings）
+    """
     engine = db.get_connection()
-    sql = """
-    SELECT symbol FROM daily_stock_moving_averages
-    WHERE current_price > ma_50
-    AND ma_50 > ma_150
-    AND ma_150 > ma_200
-    AND current_price >= low_of_52weeks * 1.3 
-    AND current_price >= high_of_52weeks * 0.75;
+    rs_join = ""
+    rs_condition = ""
+    if min_rs_rating is not None:
+        rs_join = "JOIN daily_stock_rs_ratings AS rs ON rs.symbol = ma.symbol AND rs.date = ma.date"
+        rs_condition = f"AND rs.rs_rating >= {int(min_rs_rating)}"
+    sql = f"""
+    SELECT ma.symbol FROM daily_stock_moving_averages AS ma
+    {rs_join}
+    WHERE ma.current_price > ma.ma_50
+    AND ma.ma_50 > ma.ma_150
+    AND ma.ma_150 > ma.ma_200
+    AND ma.current_price >= ma.low_of_52weeks * 1.3 
+    AND ma.current_price >= ma.high_of_52weeks * 0.75
+    {rs_condition};
     """
     df = pd.read_sql_query(sql, engine)
     return df
 
 
-def get_screening_results(ma_200_up_trend=False, profit_up_trend=False, cup_with_handle=False):
+@utils.timer(metric='db_query_duration_seconds')
+def query_rs_ratings(date=None, min_rs_rating=None):
+    """
+    查询某个交易日所有股票的 RS rating，默认为最新交易日。
+    """
+    engine = db.get_connection()
+    date_condition = f"'{date}'" if date is not None else "(SELECT MAX(date) FROM daily_stock_rs_ratings)"
+    rating_condition = f"AND rs_rating >= {int(min_rs_rating)}" if min_rs_rating is not None else ""
+    sql = f"""
+    SELECT date, symbol, rs_score, rs_rating
+    FROM daily_stock_rs_ratings
+    WHERE date = {date_condition} {rating_condition}
+    ORDER BY rs_rating DESC;
+    """
+    return pd.read_sql_query(sql, engine)
+
+
+def screening_condition(ma_200_up_trend=False, profit_up_trend=False, cup_with_handle=False, exact=True,
+                        alias=''):
+    """
+    生成 screening_output 的筛选条件。
+
+    :param exact: 为 True 时三个标记都必须与参数相等；为 False 时只要求参数为 True 的标记（前置筛选）成立，
+                  其余标记不限，供各筛选步骤选取候选股票，重复运行时不受下游标记的影响
+    :param alias: 表别名前缀，如 'so.'
+    """
+    values = {'ma_200_up_trend': ma_200_up_trend, 'profit_up_trend': profit_up_trend,
+              'cup_with_handle': cup_with_handle}
+    conditions = [f"{alias}{flag}={value}" for flag, value in values.items() if exact or value]
+    return ' AND '.join(conditions) if len(conditions) > 0 else 'TRUE'
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def get_screening_results(ma_200_up_trend=False, profit_up_trend=False, cup_with_handle=False, exact=True):
     engine = db.get_connection()
+    condition = screening_condition(ma_200_up_trend, profit_up_trend, cup_with_handle, exact, alias='so.')
     sql = f"""
     select dsp.date, dsp.symbol, dsp.close, dsp.volume, dsp.open, dsp.high, dsp.low
     from daily_stock_prices_realtime as dsp
     join screening_output as so on so.symbol=dsp.symbol
-    WHERE so.ma_200_up_trend={ma_200_up_trend} AND 
-    so.profit_up_trend={profit_up_trend} AND 
-    so.cup_with_handle={cup_with_handle};
+    WHERE {condition};
     """
-    print(sql)
+    logger.debug(sql)
     df = pd.read_sql_query(sql, engine)
     return df
 
 
-def write_df_to_table(df, table_name):
-    # 配置日志
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
+def _compact_price_dtypes(df):
+    """
+    压缩日线数据的内存占用：symbol 为分类类型，价格为 float32，日期为 datetime64。
+    """
+    df['symbol'] = df['symbol'].astype('category')
+    df['date'] = pd.to_datetime(df['date'])
+    for column in ['close', 'open', 'high', 'low']:
+        df[column] = df[column].astype('float32')
+    df['volume'] = pd.to_numeric(df['volume'], downcast='integer')
+    return df
+
+
+def iter_screening_results(ma_200_up_trend=False, profit_up_trend=False, cup_with_handle=False, start_date=None,
+                           chunksize=200000, exact=True):
+    """
+    以服务端游标流式读取筛选结果，按 symbol 顺序分块返回，每块只包含完整的 symbol。
+
+    :param start_date: 只读取该日期之后的数据（可选）
+    :param chunksize: 每次从游标读取的行数
+    :param exact: 见 screening_condition
+    """
+    engine = db.get_connection()
+    condition = screening_condition(ma_200_up_trend, profit_up_trend, cup_with_handle, exact, alias='so.')
+    date_condition = f"AND dsp.date >= '{start_date}'" if start_date is not None else ""
+    sql = f"""
+    select dsp.date, dsp.symbol, dsp.close, dsp.volume, dsp.open, dsp.high, dsp.low
+    from daily_stock_prices_realtime as dsp
+    join screening_output as so on so.symbol=dsp.symbol
+    WHERE {condition}
+    {date_condition}
+    ORDER BY dsp.symbol, dsp.date;
+    """
+    with engine.connect().execution_options(stream_results=True) as connection:
+        carry = None
+        for chunk in pd.read_sql_query(sql, connection, chunksize=chunksize):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            # 最后一个 symbol 可能还有数据在下一块，留到下一块一起返回
+            last_symbol = chunk['symbol'].iloc[-1]
+            is_last = (chunk['symbol'] == last_symbol).to_numpy()
+            carry = chunk[is_last]
+            if not is_last.all():
+                yield _compact_price_dtypes(chunk[~is_last].reset_index(drop=True))
+        if carry is not None and not carry.empty:
+            yield _compact_price_dtypes(carry.reset_index(drop=True))
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_screening_symbols(ma_200_up_trend=False, profit_up_trend=False, cup_with_handle=False, exact=True):
     engine = db.get_connection()
+    sql = f"""
+    select symbol from screening_output
+    WHERE {screening_condition(ma_200_up_trend, profit_up_trend, cup_with_handle, exact)};
+    """
+    df = pd.read_sql_query(sql, engine)
+    return df
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_daily_stock_prices_after(start_date, mode='realtime', symbols=None):
+    """
+    查询所有股票在 start_date 之后（不含）的日线数据。
+
+    :param symbols: 只查询这些股票（可选）
+    """
+    table_name = price_table(mode)
+
+    symbol_condition = ""
+    if symbols is not None:
+        if len(symbols) == 0:
+            return pd.DataFrame(columns=['date', 'symbol', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
+        symbol_condition = "AND symbol IN ({})".format(', '.join(f"'{symbol}'" for symbol in symbols))
+    engine = db.get_connection()
+    sql = f"""
+    SELECT date, symbol, open, high, low, close, adj_close, volume
+    FROM {table_name}
+    WHERE date > '{start_date}' {symbol_condition}
+    ORDER BY symbol, date;
+    """
+    return pd.read_sql_query(sql, engine)
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_table_checksum(table_name):
+    """
+    查询表的校验和，用于判断表内容是否变化。
+    """
+    engine = db.get_connection()
+    with engine.connect() as connection:
+        row = connection.execute(text(f"CHECKSUM TABLE {table_name};")).fetchone()
+    return str(row[1])
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_price_watermark(mode='realtime'):
+    """
+    查询价格表的行数和最新日期，用于判断价格数据是否变化（比校验和代价小）。
+    """
+    table_name = price_table(mode)
+
+    engine = db.get_connection()
+    with engine.connect() as connection:
+        row = connection.execute(text(f"SELECT COUNT(*), MAX(date) FROM {table_name};")).fetchone()
+    return f"{row[0]}:{row[1]}"
+
+
+def _upsert_method(update_columns=None):
+    """
+    生成 pandas to_sql 使用的写入方法：多行 INSERT ... ON DUPLICATE KEY UPDATE。
+    """
+    def method(pd_table, conn, keys, data_iter):
+        rows = [dict(zip(keys, row)) for row in data_iter]
+        stmt = mysql_insert(pd_table.table).values(rows)
+        columns = update_columns if update_columns is not None else keys
+        stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in columns})
+        result = conn.execute(stmt)
+        return result.rowcount
+
+    return method
+
+
+def _load_data_infile(df, table_name, connection, upsert=False):
+    """
+    将 DataFrame 写入临时 CSV 文件，再用 LOAD DATA LOCAL INFILE 批量导入。
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+        df.to_csv(f, index=False, header=False, na_rep='\\N', lineterminator='\n')
+        file_path = f.name
     try:
-        with engine.connect() as connection:
-            logger.info("Database connection successful.")
-            df.to_sql(table_name, connection, if_exists="append", index=False)
-            logger.info(f"Data written to table {table_name} successfully.")
+        columns = ', '.join(f'`{column}`' for column in df.columns)
+        duplicate_clause = 'REPLACE' if upsert else 'IGNORE'
+        sql = f"""
+        LOAD DATA LOCAL INFILE '{file_path}' {duplicate_clause} INTO TABLE {table_name}
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+        LINES TERMINATED BY '\\n'
+        ({columns});
+        """
+        connection.execute(text(sql))
+    finally:
+        os.remove(file_path)
+
+
+@utils.timer(metric='db_write_duration_seconds')
+def write_df_to_table(df, table_name, method='multi', chunksize=WRITE_CHUNK_SIZE, upsert=False, update_columns=None):
+    """
+    将 DataFrame 批量写入数据库表，返回写入行数。
+
+    :param df: 待写入的 DataFrame
+    :param table_name: 表名
+    :param method: 'multi' 使用分块的多行 INSERT；'load_data' 使用 LOAD DATA LOCAL INFILE
+    :param chunksize: 每条多行 INSERT 包含的行数
+    :param upsert: 为 True 时主键冲突则更新（INSERT ... ON DUPLICATE KEY UPDATE / REPLACE），可省去写入前的去重查询
+    :param update_columns: upsert 时需要更新的列，默认为全部列。LOAD DATA 的 REPLACE 会整行覆盖，
+                           指定 update_columns 时改用 INSERT ... ON DUPLICATE KEY UPDATE
+    """
+    if df.empty:
+        return 0
+
+    if method == 'load_data' and upsert and update_columns is not None:
+        method = 'multi'
+    engine = db.get_bulk_connection() if method == 'load_data' else db.get_connection()
+    start_time = time.perf_counter()
+    try:
+        with engine.begin() as connection:
+            if method == 'load_data':
+                _load_data_infile(df, table_name, connection, upsert)
+            elif upsert:
+                df.to_sql(table_name, connection, if_exists="append", index=False, chunksize=chunksize,
+                          method=_upsert_method(update_columns))
+            else:
+                df.to_sql(table_name, connection, if_exists="append", index=False, chunksize=chunksize,
+                          method='multi')
     except Exception as e:
         logger.error(f"Error writing to table {table_name}: {e}")
+        return 0
+
+    elapsed = time.perf_counter() - start_time
+    rows_per_sec = len(df) / elapsed if elapsed > 0 else 0
+    registry.counter('rows_written_total', 'Rows written to the database').inc(len(df), table=table_name)
+    registry.gauge('rows_written_per_second', 'Write throughput of the last batch').set(rows_per_sec, table=table_name)
+    logger.info(f"Wrote {len(df)} rows to table {table_name} in {elapsed:.2f}s ({rows_per_sec:.0f} rows/sec).")
+    return len(df)
+
+
+@utils.timer(metric='db_write_duration_seconds')
+def replace_moving_averages(df, chunk_symbols=1000):
+    """
+    在一个事务内替换 daily_stock_moving_averages 中 df 涉及的股票的数据（每只股票只保留最新一行），
+    其余股票不变。返回写入行数。
+    """
+    if df.empty:
+        return 0
+    engine = db.get_connection()
+    symbol_list = df['symbol'].unique().tolist()
+    with engine.begin() as connection:
+        for i in range(0, len(symbol_list), chunk_symbols):
+            symbols = ', '.join(f"'{symbol}'" for symbol in symbol_list[i:i + chunk_symbols])
+            connection.execute(text(f"DELETE FROM daily_stock_moving_averages WHERE symbol IN ({symbols});"))
+        df.to_sql('daily_stock_moving_averages', connection, if_exists="append", index=False,
+                  chunksize=WRITE_CHUNK_SIZE, method='multi')
+    registry.counter('rows_written_total', 'Rows written to the database').inc(len(df),
+                                                                               table='daily_stock_moving_averages')
+    logger.info(f"Replaced moving averages of {len(symbol_list)} symbols.")
+    return len(df)
+
+
+def remove_inactive_moving_averages():
+    """
+    删除非活跃股票的均线数据，与只计算活跃股票的全量刷新保持一致。
+    """
+    sql = """
+    DELETE FROM daily_stock_moving_averages
+    WHERE symbol NOT IN (SELECT symbol FROM tickers WHERE status = 'Active');
+    """
+    execute_sql(sql)
 
 
+@utils.timer(metric='db_write_duration_seconds')
+def refresh_table_atomically(df, table_name):
+    """
+    影子表刷新：先把数据写入结构和索引相同的 staging 表，再用一条 RENAME TABLE 原子替换，
+    读取方始终看到完整的旧表或新表，不会看到空表或写了一半的表。
+
+    :return: 写入行数，写入失败时原表保持不变并返回 0
+    """
+    staging_table = f'{table_name}_staging'
+    old_table = f'{table_name}_old'
+
+    execute_sql(f"DROP TABLE IF EXISTS {staging_table};")
+    execute_sql(f"CREATE TABLE {staging_table} LIKE {table_name};")
+
+    rows = write_df_to_table(df, staging_table)
+    if rows != len(df):
+        logger.error(f"Refresh of table {table_name} aborted, {table_name} is unchanged.")
+        execute_sql(f"DROP TABLE IF EXISTS {staging_table};")
+        return 0
+
+    execute_sql(f"DROP TABLE IF EXISTS {old_table};")
+    execute_sql(f"RENAME TABLE {table_name} TO {old_table}, {staging_table} TO {table_name};")
+    execute_sql(f"DROP TABLE {old_table};")
+    return rows
+
+
+@utils.timer(metric='db_query_duration_seconds')
+def query_rollover_cutoffs(sessions=REALTIME_SESSIONS):
+    """
+    按地区查询 realtime 表中倒数第 sessions 个交易日，早于该日期的数据需要移入 history 表。
+    各市场的休市日不同，交易日按地区分别计数，保证每个市场都保留自己的 sessions 个交易日。
+
+    :return: {region: 截止日期}，交易日不足 sessions 个的地区不包含在内
+    """
+    engine = db.get_connection()
+    sql = """
+    SELECT DISTINCT t.region, dsp.date
+    FROM daily_stock_prices_realtime AS dsp
+    JOIN tickers AS t ON dsp.symbol = t.symbol;
+    """
+    df = pd.read_sql_query(sql, engine)
+    cutoffs = {}
+    for region, group in df.groupby('region'):
+        dates = group['date'].sort_values(ascending=False)
+        if len(dates) >= sessions:
+            cutoffs[region] = str(dates.iloc[sessions - 1])
+    return cutoffs
+
+
+@utils.timer(metric='db_write_duration_seconds')
+def rollover_realtime_prices(sessions=REALTIME_SESSIONS, chunk_symbols=500):
+    """
+    把 realtime 表中早于最近 sessions 个交易日的数据移入 history 表，每个地区按自己的交易日计数。
+
+    按地区和股票分批，每批在一个事务内 INSERT ... SELECT 到 history 后从 realtime 删除，
+    两条语句都沿 (symbol, date) 主键查询。中途失败时已完成的批次保持不变，重跑即可继续。
+
+    :param sessions: realtime 表保留的交易日数
+    :param chunk_symbols: 每批移动的股票数量
+    :return: ({region: 截止日期}, 移动的行数)
+    """
+    cutoffs = query_rollover_cutoffs(sessions)
+    if len(cutoffs) == 0:
+        print(f"Less than {sessions} sessions in realtime table, nothing to roll over.")
+        return {}, 0
+
+    engine = db.get_connection()
+    columns = 'date, symbol, adj_close, close, high, low, open, volume'
+    # 不同地区的代码区间会交叉（如 A 股与港股都是数字代码），每批用明确的代码列表而不是 BETWEEN
+    condition = "symbol IN :symbols AND date < :cutoff"
+    insert_sql = text(f"""
+    INSERT INTO daily_stock_prices_history ({columns})
+    SELECT {columns} FROM daily_stock_prices_realtime
+    WHERE {condition}
+    ON DUPLICATE KEY UPDATE adj_close=VALUES(adj_close), close=VALUES(close), high=VALUES(high),
+    low=VALUES(low), open=VALUES(open), volume=VALUES(volume);
+    """).bindparams(bindparam('symbols', expanding=True))
+    delete_sql = text(f"DELETE FROM daily_stock_prices_realtime WHERE {condition};").bindparams(
+        bindparam('symbols', expanding=True))
+
+    moved = 0
+    for region, cutoff in cutoffs.items():
+        symbols = pd.read_sql_query(f"""
+        SELECT DISTINCT dsp.symbol FROM daily_stock_prices_realtime AS dsp
+        JOIN tickers AS t ON dsp.symbol = t.symbol
+        WHERE t.region = '{region}' AND dsp.date < '{cutoff}'
+        ORDER BY dsp.symbol;
+        """, engine)['symbol'].tolist()
+
+        for i in range(0, len(symbols), chunk_symbols):
+            params = {'symbols': symbols[i:i + chunk_symbols], 'cutoff': cutoff}
+            with engine.begin() as connection:
+                # realtime 中的数据较新，覆盖 history 中已存在的同一天数据
+                connection.execute(insert_sql, params)
+                result = connection.execute(delete_sql, params)
+                moved += result.rowcount
+            logger.info(f"Rolled over {region} symbols {params['symbols'][0]}..{params['symbols'][-1]}, "
+                        f"{moved} rows moved so far.")
+        print(f"Region '{region}': moved rows before {cutoff} from realtime to history.")
+
+    registry.counter('rows_rolled_over_total', 'Rows moved from realtime to history').inc(moved)
+    print(f"Moved {moved} rows from realtime to history.")
+    return cutoffs, moved
+
+
+@utils.timer(metric='db_write_duration_seconds')
 def execute_sql(sql):
     engine = db.get_connection()
     with engine.connect() as connection:
@@ -261,27 +709,78 @@ def update_ticker_status(status, symbols):
     execute_sql(sql)
 
 
-def update_ma_200_up_trend(symbol_list):
-    symbols = ', '.join(f"'{symbol}'" for symbol in symbol_list)
-    sql = f"""
-    UPDATE screening_output set ma_200_up_trend=True WHERE symbol in ({symbols});
+def update_ticker_statuses(symbol_status):
     """
-    execute_sql(sql)
+    在一个事务中批量更新多只股票的状态，symbol 和 status 通过参数绑定传入。
 
-def update_profit_up_trend(symbol_list):
-    symbols = ', '.join(f"'{symbol}'" for symbol in symbol_list)
-    sql = f"""
-    UPDATE screening_output set profit_up_trend=True WHERE symbol in ({symbols});
+    :param symbol_status: {symbol: status}
     """
-    execute_sql(sql)
+    if len(symbol_status) == 0:
+        return
+    rows = [{'symbol': symbol, 'status': status} for symbol, status in symbol_status.items()]
+    engine = db.get_connection()
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE tickers SET status = :status WHERE symbol = :symbol;"), rows)
 
 
-def update_cup_with_handle(symbol_list):
-    symbols = ', '.join(f"'{symbol}'" for symbol in symbol_list)
-    sql = f"""
-    UPDATE screening_output set cup_with_handle=True WHERE symbol in ({symbols});
+@utils.timer(metric='db_write_duration_seconds')
+def update_screening_flags(flags):
     """
-    execute_sql(sql)
+    批量更新 screening_output 的筛选标记。
+
+    先把 (symbol, flag, value) 一次性写入临时表，再用一条 JOIN UPDATE 更新所有标记；
+    同一标记下未列出的 symbol 会被重置为 False。symbol 通过参数绑定传入，标记名只允许 SCREENING_FLAGS 中的值。
+
+    :param flags: {flag: symbol 列表}
+    """
+    for flag in flags:
+        if flag not in SCREENING_FLAGS:
+            raise ValueError(f"Invalid screening flag: '{flag}'.")
+    if len(flags) == 0:
+        return
+
+    rows = [{'symbol': symbol, 'flag': flag, 'value': True}
+            for flag, symbols in flags.items() for symbol in set(symbols)]
+    pivot = ', '.join(f"MAX(CASE WHEN flag = '{flag}' THEN value END) AS {flag}" for flag in flags)
+    assignments = ', '.join(f"so.{flag} = COALESCE(f.{flag}, FALSE)" for flag in flags)
+
+    engine = db.get_connection()
+    with engine.begin() as connection:
+        connection.execute(text("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS screening_flags_staging (
+            symbol VARCHAR(20) NOT NULL,
+            flag   VARCHAR(32) NOT NULL,
+            value  BOOLEAN     NOT NULL,
+            PRIMARY KEY (symbol, flag)
+        );
+        """))
+        connection.execute(text("DELETE FROM screening_flags_staging;"))
+        if len(rows) > 0:
+            connection.execute(text("""
+            INSERT INTO screening_flags_staging (symbol, flag, value) VALUES (:symbol, :flag, :value);
+            """), rows)
+        connection.execute(text(f"""
+        UPDATE screening_output AS so
+        LEFT JOIN (
+            SELECT symbol, {pivot}
+            FROM screening_flags_staging
+            GROUP BY symbol
+        ) AS f ON f.symbol = so.symbol
+        SET {assignments};
+        """))
+        connection.execute(text("DROP TEMPORARY TABLE screening_flags_staging;"))
+
+
+def update_ma_200_up_trend(symbol_list):
+    update_screening_flags({'ma_200_up_trend': symbol_list})
+
+
+def update_profit_up_trend(symbol_list):
+    update_screening_flags({'profit_up_trend': symbol_list})
+
+
+def update_cup_with_handle(symbol_list):
+    update_screening_flags({'cup_with_handle': symbol_list})
 
 
 def truncate_table(table_name):
@@ -289,31 +788,46 @@ def truncate_table(table_name):
     execute_sql(sql)
 
 
-def find_incomplete_symbols():
+@utils.timer(metric='db_query_duration_seconds')
+def query_trading_dates(region, start_date, min_share=0.5):
+    """
+    以价格表中实际出现过的日期作为某个地区的交易日历。
+
+    :param min_share: 有数据的股票数至少达到当天最多股票数的该比例才算交易日，排除个别股票的异常日期
+    """
     engine = db.get_connection()
-    sql = """
-    SELECT DISTINCT symbol
-    FROM (
-    SELECT symbol
-    FROM daily_stock_prices_realtime
-    GROUP BY symbol
-    HAVING COUNT(*) < 254
-    ) AS temp;
+    sql = f"""
+    SELECT dsp.date, COUNT(*) AS symbols
+    FROM daily_stock_prices_realtime AS dsp
+    JOIN tickers AS t ON dsp.symbol = t.symbol
+    WHERE t.region = '{region}' AND dsp.date >= '{start_date}'
+    GROUP BY dsp.date
+    ORDER BY dsp.date;
     """
-    return pd.read_sql_query(sql, engine)
+    df = pd.read_sql_query(sql, engine)
+    if df.empty:
+        return []
+    df = df[df['symbols'] >= df['symbols'].max() * min_share]
+    return pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d').tolist()
 
 
-def remove_imcomplete_symbols(symbol_list):
-    if len(symbol_list) > 0:
-        symbols = ', '.join(f"'{symbol}'" for symbol in symbol_list)
-        sql = f"""
-        DELETE FROM daily_stock_prices_realtime WHERE symbol in ({symbols})
-        """
-        execute_sql(sql)
-    else:
-        print('No incomplete symbols found.')
+@utils.timer(metric='db_query_duration_seconds')
+def query_price_coverage(region, start_date):
+    """
+    查询某个地区所有活跃股票在 start_date 之后的日线数量和首末日期，没有数据的股票 bars 为 0。
+    """
+    engine = db.get_connection()
+    sql = f"""
+    SELECT t.symbol, t.ipo_date, COUNT(dsp.date) AS bars, MIN(dsp.date) AS first_date, MAX(dsp.date) AS last_date
+    FROM tickers AS t
+    LEFT JOIN daily_stock_prices_realtime AS dsp ON dsp.symbol = t.symbol AND dsp.date >= '{start_date}'
+    WHERE t.region = '{region}' AND t.status = 'Active'
+    GROUP BY t.symbol, t.ipo_date;
+    """
+    return pd.read_sql_query(sql, engine)
 
 
+@utils.timer(metric='db_query_duration_seconds')
 def find_existed_symbols():
     engine = db.get_connection()
     sql = """
@@ -323,4 +837,4 @@ def find_existed_symbols():
     return pd.read_sql_query(sql, engine)
 
 if __name__ == '__main__':
-    print(find_incomplete_symbols())
\ No newline at end of file
+    print(query_price_coverage('us', '2000-01-01'))
\ No newline at end of file
@@ -0,0 +1,233 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from database import mydb
+from tools import utils
+
+#####################################
+# daily_stock_prices_realtime 的本地列式缓存
+# 数据按月份分区，每个分区每列一个 .npy 文件，读取时使用内存映射
+# usage:
+# from database import price_cache
+# price_cache.sync()
+# price_cache.get_screening_results(ma_200_up_trend=True)
+#####################################
+
+
+CACHE_DIR = os.path.join(utils.get_root_path(), 'cache', 'prices')
+META_FILE = 'meta.json'
+COLUMNS = ['date', 'symbol', 'open', 'high', 'low', 'close', 'adj_close', 'volume']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+# 同步时重新读取最近几天，覆盖晚到的数据
+OVERLAP_DAYS = 10
+
+_lock = threading.Lock()
+
+
+def _read_meta():
+    meta_path = os.path.join(CACHE_DIR, META_FILE)
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def _write_meta(meta):
+    with open(os.path.join(CACHE_DIR, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+
+def _list_partitions():
+    if not os.path.exists(CACHE_DIR):
+        return []
+    return sorted(name for name in os.listdir(CACHE_DIR)
+                  if os.path.isdir(os.path.join(CACHE_DIR, name)) and not name.endswith('.tmp'))
+
+
+def _load_partition(partition, mmap_mode='r'):
+    partition_dir = os.path.join(CACHE_DIR, partition)
+    return {column: np.load(os.path.join(partition_dir, f'{column}.npy'), mmap_mode=mmap_mode)
+            for column in COLUMNS}
+
+
+def _save_partition(partition, df):
+    """
+    先写入临时目录再替换，避免读到写了一半的分区。
+    """
+    partition_dir = os.path.join(CACHE_DIR, partition)
+    tmp_dir = partition_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    np.save(os.path.join(tmp_dir, 'date.npy'), df['date'].to_numpy(dtype='datetime64[D]'))
+    np.save(os.path.join(tmp_dir, 'symbol.npy'), df['symbol'].to_numpy(dtype=str))
+    for column in PRICE_COLUMNS:
+        np.save(os.path.join(tmp_dir, f'{column}.npy'), df[column].to_numpy(dtype='float64'))
+
+    if os.path.exists(partition_dir):
+        shutil.rmtree(partition_dir)
+    os.rename(tmp_dir, partition_dir)
+
+
+def _append(df):
+    """
+    将新数据按月份追加到对应分区，只重写被新数据涉及的分区。
+    """
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+    for column in PRICE_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    for partition, new_df in df.groupby(df['date'].dt.strftime('%Y-%m')):
+        if os.path.exists(os.path.join(CACHE_DIR, partition)):
+            old_df = pd.DataFrame(_load_partition(partition, mmap_mode=None))
+            new_df = pd.concat([old_df, new_df[COLUMNS]], ignore_index=True)
+            new_df = new_df.drop_duplicates(['symbol', 'date'], keep='last')
+        new_df = new_df.sort_values(['symbol', 'date'])
+        _save_partition(partition, new_df)
+
+
+def mark_stale(df):
+    """
+    记录刚写入数据库的每只股票的最早日期，下次 sync 时重新读取这些股票从该日期开始的数据。
+    sync 只读取最新日期附近的数据，新上市股票的历史、补齐的缺口等较早的日线需要这样标记才会进入缓存。
+    """
+    if df.empty:
+        return
+    first_dates = pd.to_datetime(df['date']).groupby(df['symbol']).min()
+    with _lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        meta = _read_meta()
+        latest_date = meta.get('latest_date')
+        if latest_date is None:
+            # 缓存为空时 sync 会读取全部数据
+            return
+        # 晚于重叠区间起点的数据会被正常的 sync 读到
+        overlap_start = pd.Timestamp(latest_date) - pd.Timedelta(days=OVERLAP_DAYS)
+        stale = meta.get('stale', {})
+        for symbol, first_date in first_dates[first_dates <= overlap_start].items():
+            first_date = first_date.strftime('%Y-%m-%d')
+            if symbol not in stale or first_date < stale[symbol]:
+                stale[symbol] = first_date
+        meta['stale'] = stale
+        _write_meta(meta)
+
+
+def sync():
+    """
+    将数据库中比缓存更新的日期，以及 mark_stale 记录的较早数据追加到本地缓存，返回读取的行数。
+    """
+    with _lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        meta = _read_meta()
+        latest_date = meta.get('latest_date')
+        if latest_date is None:
+            start_date = '2000-01-01'
+        else:
+            start_date = (pd.Timestamp(latest_date) - pd.Timedelta(days=OVERLAP_DAYS)).strftime('%Y-%m-%d')
+
+        df = mydb.query_daily_stock_prices_after(start_date)
+        stale = meta.get('stale', {})
+        if len(stale) > 0:
+            # 取这些股票中最早的日期之前一天，query_daily_stock_prices_after 不包含起始日期
+            stale_start = (pd.Timestamp(min(stale.values())) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+            stale_df = mydb.query_daily_stock_prices_after(stale_start, symbols=list(stale))
+            df = pd.concat([stale_df, df], ignore_index=True)
+        if df.empty:
+            return 0
+
+        _append(df)
+        meta['latest_date'] = max(pd.to_datetime(df['date']).max().strftime('%Y-%m-%d'), latest_date or '')
+        meta['stale'] = {}
+        _write_meta(meta)
+        print(f"Synced {len(df)} rows to price cache.")
+        return len(df)
+
+
+def rebuild():
+    """
+    清空缓存并从数据库重新加载，用于历史数据被修补之后。
+    """
+    with _lock:
+        if os.path.exists(CACHE_DIR):
+            shutil.rmtree(CACHE_DIR)
+    return sync()
+
+
+def prune(before_date):
+    """
+    删除整月都早于 before_date 的分区，与 realtime 表的滚动窗口保持一致，返回删除的分区数。
+    before_date 所在月份的分区保留，其中较早的几天数据不影响读取结果。
+    """
+    with _lock:
+        cutoff = str(before_date)[:7]
+        partitions = [partition for partition in _list_partitions() if partition < cutoff]
+        for partition in partitions:
+            shutil.rmtree(os.path.join(CACHE_DIR, partition))
+    if len(partitions) > 0:
+        print(f"Pruned {len(partitions)} partitions before {cutoff} from price cache.")
+    return len(partitions)
+
+
+def load_prices(symbols=None, start_date=None, end_date=None, refresh=True):
+    """
+    从本地缓存读取日线数据。
+
+    :param symbols: 股票代码列表（可选，默认为全部）
+    :param start_date: 开始日期（可选）
+    :param end_date: 结束日期（可选）
+    :param refresh: 读取前是否先从数据库追加新日期
+    """
+    if refresh:
+        sync()
+
+    start = np.datetime64(start_date, 'D') if start_date is not None else None
+    end = np.datetime64(end_date, 'D') if end_date is not None else None
+    if symbols is not None:
+        symbols = np.asarray(list(symbols), dtype=str)
+
+    frames = []
+    for partition in _list_partitions():
+        # 按月份跳过不在日期区间内的分区
+        if start is not None and partition < str(start)[:7]:
+            continue
+        if end is not None and partition > str(end)[:7]:
+            continue
+
+        data = _load_partition(partition)
+        mask = np.ones(len(data['date']), dtype=bool)
+        if start is not None:
+            mask &= data['date'] >= start
+        if end is not None:
+            mask &= data['date'] <= end
+        if symbols is not None:
+            mask &= np.isin(data['symbol'], symbols)
+        if mask.any():
+            frames.append(pd.DataFrame({column: data[column][mask] for column in COLUMNS}))
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=COLUMNS)
+
+    df = pd.concat(frames, ignore_index=True)
+    return df.sort_values(['symbol', 'date']).reset_index(drop=True)
+
+
+def query_daily_stock_prices(symbol, start_date, end_date):
+    """
+    与 mydb.query_daily_stock_prices 相同，但从本地缓存读取。
+    """
+    if start_date is None:
+        start_date = '2000-01-01'  # 默认从 2000-01-01 开始获取数据
+    return load_prices([symbol], start_date, end_date)
+
+
+def get_screening_results(ma_200_up_trend=False, profit_up_trend=False, cup_with_handle=False, exact=True):
+    """
+    与 mydb.get_screening_results 相同，但日线数据从本地缓存读取。
+    """
+    symbols = mydb.query_screening_symbols(ma_200_up_trend, profit_up_trend, cup_with_handle,
+                                           exact)['symbol'].tolist()
+    df = load_prices(symbols)
+    return df[['date', 'symbol', 'close', 'volume', 'open', 'high', 'low']]
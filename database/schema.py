@@ -0,0 +1,292 @@
+import pandas as pd
+from datetime import datetime
+from database import mydb
+
+#####################################
+# 数据表结构定义、建表与迁移
+# 热点查询都按 (symbol, date) 过滤，价格表以 (symbol, date) 为聚簇主键，
+# 单只股票的日线在磁盘上连续存放，按 symbol 的范围扫描不需要回表
+# usage:
+# python -m database.schema              # 建表并补齐缺失的主键和索引
+# python -m database.schema --check      # 只检查，不修改
+# python -m database.schema --partition  # 新建价格表时按年分区
+#####################################
+
+
+PRICE_COLUMNS = """
+    `date`      DATE           NOT NULL,
+    `symbol`    VARCHAR(10)    NOT NULL,
+    `adj_close` DECIMAL(15, 4) NULL,
+    `close`     DECIMAL(15, 4) NULL,
+    `high`      DECIMAL(15, 4) NULL,
+    `low`       DECIMAL(15, 4) NULL,
+    `open`      DECIMAL(15, 4) NULL,
+    `volume`    BIGINT         NULL
+"""
+
+# 每张表的列定义、主键和二级索引 {索引名: 列}，最后一列后不能有注释（建表时在其后追加逗号）
+# InnoDB 的二级索引隐含主键列，(date) 索引即相当于 (date, symbol)
+TABLES = {
+    'tickers': {
+        'columns': """
+    `symbol`      VARCHAR(20)  NOT NULL,                -- Stock Symbol
+    `name`        VARCHAR(255) NOT NULL,                -- Stock Name
+    `region`      VARCHAR(50),                          -- 地区（如 us、hk、cn）
+    `exchange`    VARCHAR(50),                          -- 市场（如 NASDAQ、NYSE、A股）
+    `ipo_date`    DATE,                                 -- IPO Date
+    `status`      VARCHAR(255),                         -- Status
+    `update_time` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+""",
+        'primary_key': ['symbol'],
+        'indexes': {
+            # query_active_close_prices、update_inactive_tickers 按 status 过滤后取 symbol
+            'idx_status': ['status'],
+            # query_tickers_by_region
+            'idx_region_status': ['region', 'status'],
+        },
+        'partitioned': False,
+    },
+    'daily_stock_prices_realtime': {
+        'columns': PRICE_COLUMNS,
+        'primary_key': ['symbol', 'date'],
+        'indexes': {
+            # query_price_watermark 的 MAX(date)，query_daily_stock_prices_after 的按日期范围读取
+            'idx_date': ['date'],
+        },
+        'partitioned': True,
+    },
+    'daily_stock_prices_history': {
+        'columns': PRICE_COLUMNS,
+        'primary_key': ['symbol', 'date'],
+        'indexes': {
+            'idx_date': ['date'],
+        },
+        'partitioned': True,
+    },
+    'daily_stock_moving_averages': {
+        'columns': """
+    `date`            DATE           NOT NULL,
+    `symbol`          VARCHAR(10)    NOT NULL,
+    `current_price`   DECIMAL(15, 4) NULL,  -- 当前股价（adj_close）
+    `ma_50`           DECIMAL(15, 4) NULL,  -- 50 日均线
+    `ma_150`          DECIMAL(15, 4) NULL,  -- 150 日均线
+    `ma_200`          DECIMAL(15, 4) NULL,  -- 200 日均线
+    `high_of_52weeks` DECIMAL(15, 4) NULL,  -- 52周最高 / 最低
+    `low_of_52weeks`  DECIMAL(15, 4) NULL
+""",
+        'primary_key': ['symbol', 'date'],
+        'indexes': {},
+        'partitioned': False,
+    },
+    'daily_stock_rs_ratings': {
+        'columns': """
+    `date`      DATE           NOT NULL,
+    `symbol`    VARCHAR(10)    NOT NULL,
+    `rs_score`  DECIMAL(15, 6) NULL,      -- 3/6/9/12 个月加权收益，rs_rating 为当日全市场排名百分位 1~99
+    `rs_rating` TINYINT        NOT NULL
+""",
+        'primary_key': ['symbol', 'date'],
+        'indexes': {
+            # 按日期取排名靠前的股票
+            'idx_date_rating': ['date', 'rs_rating'],
+        },
+        'partitioned': False,
+    },
+    'screening_output': {
+        'columns': """
+    `symbol`          VARCHAR(10) NOT NULL,
+    `ma_200_up_trend` BOOLEAN     NOT NULL DEFAULT FALSE,
+    `profit_up_trend` BOOLEAN     NOT NULL DEFAULT FALSE,
+    `cup_with_handle` BOOLEAN     NOT NULL DEFAULT FALSE
+""",
+        'primary_key': ['symbol'],
+        'indexes': {
+            # 按筛选标记取 symbol 的覆盖索引（query_screening_symbols 及与价格表的 join）
+            'idx_flags': ['ma_200_up_trend', 'profit_up_trend', 'cup_with_handle', 'symbol'],
+        },
+        'partitioned': False,
+    },
+}
+
+# 视图定义，在所有表创建之后创建
+VIEWS = {
+    # realtime 只保留最近的交易日（见 mydb.rollover_realtime_prices），需要完整历史的读取方使用该视图
+    'daily_stock_prices_all': """
+    SELECT `date`, `symbol`, `adj_close`, `close`, `high`, `low`, `open`, `volume` FROM `daily_stock_prices_history`
+    UNION ALL
+    SELECT `date`, `symbol`, `adj_close`, `close`, `high`, `low`, `open`, `volume` FROM `daily_stock_prices_realtime`
+""",
+}
+
+# 分区起始年份，之前的数据都落在第一个分区
+PARTITION_START_YEAR = 2000
+
+
+def _quote_columns(columns):
+    return ', '.join(f'`{column}`' for column in columns)
+
+
+def partition_clause(start_year=PARTITION_START_YEAR, end_year=None):
+    """
+    按年的 RANGE 分区，最后一个分区为 MAXVALUE，新的年份不需要立即加分区。
+    分区列必须包含在所有唯一键中，价格表的主键 (symbol, date) 满足这一要求。
+    """
+    if end_year is None:
+        end_year = datetime.now().year + 1
+    partitions = [f"PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01')"
+                  for year in range(start_year, end_year + 1)]
+    partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return "PARTITION BY RANGE COLUMNS(`date`) (\n    " + ',\n    '.join(partitions) + "\n)"
+
+
+def create_table_sql(table_name, partition=False):
+    """
+    生成建表语句。
+
+    :param partition: 为 True 时对支持分区的表按年分区
+    """
+    table = TABLES[table_name]
+    definitions = [table['columns'].rstrip().rstrip(','),
+                   f"    PRIMARY KEY ({_quote_columns(table['primary_key'])})"]
+    for index_name, columns in table['indexes'].items():
+        definitions.append(f"    INDEX `{index_name}` ({_quote_columns(columns)})")
+    sql = f"CREATE TABLE IF NOT EXISTS `{table_name}` (" + ',\n'.join(definitions) + "\n)"
+    if partition and table['partitioned']:
+        sql += '\n' + partition_clause()
+    return sql + ';'
+
+
+def create_view_sql(view_name):
+    return f"CREATE OR REPLACE VIEW `{view_name}` AS" + VIEWS[view_name].rstrip() + ";"
+
+
+def query_existing_tables():
+    engine = mydb.db.get_connection()
+    sql = """
+    SELECT table_name AS table_name
+    FROM information_schema.tables
+    WHERE table_schema = DATABASE();
+    """
+    return set(pd.read_sql_query(sql, engine)['table_name'])
+
+
+def query_indexes():
+    """
+    查询当前数据库中所有索引，返回 {表名: {索引名: [列]}}。
+    """
+    engine = mydb.db.get_connection()
+    sql = """
+    SELECT table_name AS table_name, index_name AS index_name, column_name AS column_name
+    FROM information_schema.statistics
+    WHERE table_schema = DATABASE()
+    ORDER BY table_name, index_name, seq_in_index;
+    """
+    df = pd.read_sql_query(sql, engine)
+    indexes = {}
+    for (table_name, index_name), group in df.groupby(['table_name', 'index_name'], sort=False):
+        indexes.setdefault(table_name, {})[index_name] = group['column_name'].tolist()
+    return indexes
+
+
+def check_indexes():
+    """
+    检查现有数据库的主键和索引是否与 TABLES 一致，返回缺失或不一致的项。
+
+    :return: DataFrame，列为 table、index、expected、actual、issue
+    """
+    existing_tables = query_existing_tables()
+    indexes = query_indexes()
+    issues = []
+    for table_name, table in TABLES.items():
+        if table_name not in existing_tables:
+            issues.append({'table': table_name, 'index': None, 'expected': None, 'actual': None,
+                           'issue': 'missing table'})
+            continue
+        actual = indexes.get(table_name, {})
+        expected = {'PRIMARY': table['primary_key'], **table['indexes']}
+        for index_name, columns in expected.items():
+            if index_name == 'PRIMARY':
+                # 主键决定聚簇顺序，列相同的二级索引不能代替，与 migrate_table 的判断一致
+                if actual.get('PRIMARY') == columns:
+                    continue
+            elif columns in actual.values():
+                # 名称不同但列相同的二级索引同样可用
+                continue
+            issues.append({'table': table_name, 'index': index_name, 'expected': columns,
+                           'actual': actual.get(index_name),
+                           'issue': 'missing index' if index_name not in actual else 'wrong columns'})
+    return pd.DataFrame(issues, columns=['table', 'index', 'expected', 'actual', 'issue'])
+
+
+def migrate_table(table_name, actual_indexes):
+    """
+    把已存在的表迁移到 TABLES 中的定义：调整主键，补齐缺失的索引。
+    """
+    table = TABLES[table_name]
+    statements = []
+
+    primary_key = actual_indexes.get('PRIMARY')
+    if primary_key != table['primary_key']:
+        drop = "DROP PRIMARY KEY, " if primary_key is not None else ""
+        statements.append(f"ALTER TABLE `{table_name}` {drop}ADD PRIMARY KEY ({_quote_columns(table['primary_key'])});")
+
+    for index_name, columns in table['indexes'].items():
+        if columns in actual_indexes.values():
+            continue
+        if index_name in actual_indexes:
+            statements.append(f"ALTER TABLE `{table_name}` DROP INDEX `{index_name}`;")
+        statements.append(f"ALTER TABLE `{table_name}` ADD INDEX `{index_name}` ({_quote_columns(columns)});")
+
+    # 主键改为 (symbol, date) 后，旧的 (symbol, date) 二级索引是多余的
+    if table['primary_key'] == ['symbol', 'date'] and actual_indexes.get('idx_symbol_date') == ['symbol', 'date']:
+        statements.append(f"ALTER TABLE `{table_name}` DROP INDEX `idx_symbol_date`;")
+
+    for sql in statements:
+        print(sql)
+        mydb.execute_sql(sql)
+    return statements
+
+
+def create_or_migrate(partition=False):
+    """
+    创建不存在的表，已存在的表补齐主键和索引，最后创建视图。已有数据的表不会被重新分区。
+
+    :param partition: 为 True 时新建的价格表按年分区
+    """
+    existing_tables = query_existing_tables()
+    indexes = query_indexes()
+    for table_name in TABLES:
+        if table_name not in existing_tables:
+            print(f"Creating table {table_name}...")
+            mydb.execute_sql(create_table_sql(table_name, partition))
+        else:
+            migrate_table(table_name, indexes.get(table_name, {}))
+    for view_name in VIEWS:
+        mydb.execute_sql(create_view_sql(view_name))
+
+
+def write_schema_sql(path):
+    """
+    把 TABLES 的定义导出为 SQL 文件，保持 schema.sql 与本模块一致。
+    """
+    with open(path, 'w') as f:
+        f.write("CREATE DATABASE IF NOT EXISTS `stock-wizard`;\n\n")
+        for table_name in TABLES:
+            f.write(create_table_sql(table_name) + '\n\n')
+        for view_name in VIEWS:
+            f.write(create_view_sql(view_name) + '\n\n')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Create tables and check or migrate indexes.')
+    parser.add_argument('--check', action='store_true', help='only report missing indexes')
+    parser.add_argument('--partition', action='store_true', help='partition new price tables by year')
+    args = parser.parse_args()
+
+    if args.check:
+        result = check_indexes()
+        print(result.to_string(index=False) if not result.empty else 'All indexes are in place.')
+    else:
+        create_or_migrate(args.partition)
@@ -1,54 +1,76 @@
-CREATE DATABASE `stock-wizard`;
-
-CREATE DATABASE `stock-wizard`;
-
-CREATE TABLE `tickers` (
-    `symbol` VARCHAR(20) PRIMARY KEY,  -- Stock Symbol，Primary Key
-    `name` VARCHAR(255) NOT NULL,      -- Stock Name
-    `region` VARCHAR(50),              -- 地区（如 US、HK、CN）
-    `exchange` VARCHAR(50),            -- 市场（如 NASDAQ、NYSE、A股）
-    `ipo_date` DATE,                   -- IPO Date
-    `status` VARCHAR(255),             -- Status
-    `update_time` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP  -- 更新时间，自动更新
+CREATE DATABASE IF NOT EXISTS `stock-wizard`;
+
+CREATE TABLE IF NOT EXISTS `tickers` (
+    `symbol`      VARCHAR(20)  NOT NULL,                -- Stock Symbol
+    `name`        VARCHAR(255) NOT NULL,                -- Stock Name
+    `region`      VARCHAR(50),                          -- 地区（如 us、hk、cn）
+    `exchange`    VARCHAR(50),                          -- 市场（如 NASDAQ、NYSE、A股）
+    `ipo_date`    DATE,                                 -- IPO Date
+    `status`      VARCHAR(255),                         -- Status
+    `update_time` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`symbol`),
+    INDEX `idx_status` (`status`),
+    INDEX `idx_region_status` (`region`, `status`)
+);
+
+CREATE TABLE IF NOT EXISTS `daily_stock_prices_realtime` (
+    `date`      DATE           NOT NULL,
+    `symbol`    VARCHAR(10)    NOT NULL,
+    `adj_close` DECIMAL(15, 4) NULL,
+    `close`     DECIMAL(15, 4) NULL,
+    `high`      DECIMAL(15, 4) NULL,
+    `low`       DECIMAL(15, 4) NULL,
+    `open`      DECIMAL(15, 4) NULL,
+    `volume`    BIGINT         NULL,
+    PRIMARY KEY (`symbol`, `date`),
+    INDEX `idx_date` (`date`)
 );
-CREATE INDEX idx_status ON tickers (status);
-
-CREATE TABLE daily_stock_prices_realtime
-(
-    date      date           not null,
-    symbol    varchar(10)    not null,
-    adj_close decimal(15, 4) null,
-    close     decimal(15, 4) null,
-    high      decimal(15, 4) null,
-    low       decimal(15, 4) null,
-    open      decimal(15, 4) null,
-    volume    bigint         null,
-    primary key (date, symbol)
+
+CREATE TABLE IF NOT EXISTS `daily_stock_prices_history` (
+    `date`      DATE           NOT NULL,
+    `symbol`    VARCHAR(10)    NOT NULL,
+    `adj_close` DECIMAL(15, 4) NULL,
+    `close`     DECIMAL(15, 4) NULL,
+    `high`      DECIMAL(15, 4) NULL,
+    `low`       DECIMAL(15, 4) NULL,
+    `open`      DECIMAL(15, 4) NULL,
+    `volume`    BIGINT         NULL,
+    PRIMARY KEY (`symbol`, `date`),
+    INDEX `idx_date` (`date`)
 );
-CREATE INDEX idx_symbol_date ON daily_stock_prices_realtime (symbol, date);
-
-CREATE TABLE daily_stock_prices_history
-(
-    date      date           not null,
-    symbol    varchar(10)    not null,
-    adj_close decimal(15, 4) null,
-    close     decimal(15, 4) null,
-    high      decimal(15, 4) null,
-    low       decimal(15, 4) null,
-    open      decimal(15, 4) null,
-    volume    bigint         null,
-    primary key (date, symbol)
+
+CREATE TABLE IF NOT EXISTS `daily_stock_moving_averages` (
+    `date`            DATE           NOT NULL,
+    `symbol`          VARCHAR(10)    NOT NULL,
+    `current_price`   DECIMAL(15, 4) NULL,  -- 当前股价（adj_close）
+    `ma_50`           DECIMAL(15, 4) NULL,  -- 50 日均线
+    `ma_150`          DECIMAL(15, 4) NULL,  -- 150 日均线
+    `ma_200`          DECIMAL(15, 4) NULL,  -- 200 日均线
+    `high_of_52weeks` DECIMAL(15, 4) NULL,  -- 52周最高 / 最低
+    `low_of_52weeks`  DECIMAL(15, 4) NULL,
+    PRIMARY KEY (`symbol`, `date`)
 );
-CREATE INDEX idx_symbol_date ON daily_stock_prices_history (symbol, date);
-
-CREATE TABLE daily_stock_moving_averages (
-    date           date           NOT NULL,
-    symbol         varchar(10)    NOT NULL,
-    current_price  decimal(15, 4) NULL,  -- 当前股价（adj_close）
-    ma_50          decimal(15, 4) NULL,  -- 50 日均线
-    ma_150         decimal(15, 4) NULL,  -- 150 日均线
-    ma_200         decimal(15, 4) NULL,  -- 200 日均线
-    high_of_52weeks decimal(15, 4) NULL,  -- 52周最高
-    low_of_52weeks decimal(15, 4) NULL,  -- 52周最低
-    PRIMARY KEY (date, symbol)
-);
\ No newline at end of file
+
+CREATE TABLE IF NOT EXISTS `daily_stock_rs_ratings` (
+    `date`      DATE           NOT NULL,
+    `symbol`    VARCHAR(10)    NOT NULL,
+    `rs_score`  DECIMAL(15, 6) NULL,      -- 3/6/9/12 个月加权收益，rs_rating 为当日全市场排名百分位 1~99
+    `rs_rating` TINYINT        NOT NULL,
+    PRIMARY KEY (`symbol`, `date`),
+    INDEX `idx_date_rating` (`date`, `rs_rating`)
+);
+
+CREATE TABLE IF NOT EXISTS `screening_output` (
+    `symbol`          VARCHAR(10) NOT NULL,
+    `ma_200_up_trend` BOOLEAN     NOT NULL DEFAULT FALSE,
+    `profit_up_trend` BOOLEAN     NOT NULL DEFAULT FALSE,
+    `cup_with_handle` BOOLEAN     NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (`symbol`),
+    INDEX `idx_flags` (`ma_200_up_trend`, `profit_up_trend`, `cup_with_handle`, `symbol`)
+);
+
+CREATE OR REPLACE VIEW `daily_stock_prices_all` AS
+    SELECT `date`, `symbol`, `adj_close`, `close`, `high`, `low`, `open`, `volume` FROM `daily_stock_prices_history`
+    UNION ALL
+    SELECT `date`, `symbol`, `adj_close`, `close`, `high`, `low`, `open`, `volume` FROM `daily_stock_prices_realtime`;
+
@@ -0,0 +1,258 @@
+import os
+import shutil
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from database import mydb
+from tools import utils
+import indicators
+
+#####################################
+# 均线与 52 周高低点的增量计算
+# 每只股票保存最近 252 个收盘价的环形缓冲区、50/150/200 日的滚动和，以及最高/最低价的单调队列，
+# 新的日线到达时只需 O(1) 更新，不必重新读取历史数据。状态保存在本地，跨次运行复用
+# usage:
+# store = IndicatorStore.load()
+# store.apply(df)                  # 写入价格表后应用新日线
+# df = store.snapshot(store.dirty_symbols())
+# store.save()
+#####################################
+
+
+CACHE_DIR = os.path.join(utils.get_root_path(), 'cache', 'indicators')
+WINDOW = indicators.WEEKS_52_WINDOW
+MA_WINDOWS = indicators.MA_WINDOWS
+COLUMNS = ['symbol', 'date', 'current_price'] + [f'ma_{n}' for n in MA_WINDOWS] + \
+          ['high_of_52weeks', 'low_of_52weeks']
+
+
+class SymbolState:
+    """
+    单只股票的增量指标状态。
+
+    count 为累计收到的日线数，第 k 根日线（从 0 开始）保存在 ring[k % WINDOW]；
+    单调队列中保存的是日线序号，队首即窗口内最高（最低）价的位置。
+    """
+
+    __slots__ = ('ring', 'count', 'sums', 'max_queue', 'min_queue', 'last_date')
+
+    def __init__(self):
+        self.ring = np.full(WINDOW, np.nan)
+        self.count = 0
+        self.sums = [0.0] * len(MA_WINDOWS)
+        self.max_queue = deque()
+        self.min_queue = deque()
+        self.last_date = None
+
+    def push(self, date, close):
+        k = self.count
+        for i, n in enumerate(MA_WINDOWS):
+            if k >= n:
+                self.sums[i] -= self.ring[(k - n) % WINDOW]
+            self.sums[i] += close
+        self.ring[k % WINDOW] = close
+
+        while self.max_queue and self.ring[self.max_queue[-1] % WINDOW] <= close:
+            self.max_queue.pop()
+        self.max_queue.append(k)
+        while self.min_queue and self.ring[self.min_queue[-1] % WINDOW] >= close:
+            self.min_queue.pop()
+        self.min_queue.append(k)
+        # 移出窗口的日线
+        while self.max_queue[0] <= k - WINDOW:
+            self.max_queue.popleft()
+        while self.min_queue[0] <= k - WINDOW:
+            self.min_queue.popleft()
+
+        self.count = k + 1
+        self.last_date = date
+
+    def values(self):
+        """
+        返回 [current_price, ma_50, ma_150, ma_200, high_of_52weeks, low_of_52weeks]，
+        不足 n 天时均线取已有数据的均值，与 indicators.calculate_moving_averages_from_prices 一致。
+        """
+        current_price = self.ring[(self.count - 1) % WINDOW]
+        mas = [total / min(self.count, n) for total, n in zip(self.sums, MA_WINDOWS)]
+        high = self.ring[self.max_queue[0] % WINDOW]
+        low = self.ring[self.min_queue[0] % WINDOW]
+        return [current_price] + mas + [high, low]
+
+
+class IndicatorStore:
+    def __init__(self):
+        self.states = {}
+        # 上次写入均线表之后有新日线的股票
+        self.dirty = set()
+        # 需从价格表重建的股票：由新日线创建、缺少历史数据，或收到了不晚于已记录日期的日线（补齐的缺口、upsert 的修正）
+        self.new = set()
+        self.lock = threading.Lock()
+
+    def is_empty(self):
+        return len(self.states) == 0
+
+    def apply(self, df, new=True):
+        """
+        应用新日线，耗时只与 df 的行数有关。不晚于已记录日期的日线无法增量应用，对应股票记为需要重建。
+
+        :param df: 包含 symbol, date, close 的 DataFrame
+        :param new: 为 True 时，状态中还没有的股票记为缺少历史数据，等待 rebuild
+        :return: 实际应用的日线数
+        """
+        if df.empty:
+            return 0
+        df = df[['symbol', 'date', 'close']].dropna(subset=['close'])
+        dates = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d').to_numpy()
+        order = np.lexsort((dates, df['symbol'].to_numpy()))
+
+        applied = 0
+        with self.lock:
+            for symbol, date, close in zip(df['symbol'].to_numpy()[order], dates[order],
+                                           df['close'].to_numpy(dtype='float64')[order]):
+                state = self.states.get(symbol)
+                if state is None:
+                    state = SymbolState()
+                    self.states[symbol] = state
+                    if new:
+                        self.new.add(symbol)
+                elif date <= state.last_date:
+                    self.new.add(symbol)
+                    continue
+                state.push(date, close)
+                self.dirty.add(symbol)
+                applied += 1
+        return applied
+
+    def rebuild(self, symbols=None, start_date=None):
+        """
+        从价格表重新建立状态，用于首次运行或历史数据被修补之后。
+
+        :param symbols: 只重建这些股票（可选，默认清空状态并重建全部活跃股票）
+        """
+        if start_date is None:
+            start_date = (datetime.now() - timedelta(days=indicators.LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        df = mydb.query_active_close_prices(start_date, symbols)
+        # 只需要每只股票最近 WINDOW 根日线
+        df = df.sort_values(['symbol', 'date'])
+        df = df[df.groupby('symbol', sort=False).cumcount(ascending=False) < WINDOW]
+
+        with self.lock:
+            if symbols is None:
+                self.states = {}
+                self.new = set()
+            else:
+                for symbol in symbols:
+                    self.states.pop(symbol, None)
+                    self.new.discard(symbol)
+        applied = self.apply(df, new=False)
+        print(f"Rebuilt indicator state for {df['symbol'].nunique()} symbols from {applied} bars.")
+        return applied
+
+    def reconcile(self):
+        """
+        对比每只股票的 last_date 与价格表中的最新日期，重建不一致的股票，返回这些股票。
+
+        进程在写入数据库之后、save 之前退出时，状态会落后于数据库，而这些日线不会再被下载，
+        需要在应用新日线之前修正。
+        """
+        if self.is_empty():
+            return []
+        latest = mydb.query_latest_dates()
+        latest_dates = dict(zip(latest['symbol'], pd.to_datetime(latest['latest_date']).dt.strftime('%Y-%m-%d')))
+        with self.lock:
+            symbols = sorted(symbol for symbol, state in self.states.items()
+                             if latest_dates.get(symbol) != state.last_date)
+        if len(symbols) > 0:
+            print(f"Indicator state of {len(symbols)} symbols differs from the price table, rebuilding.")
+            self.rebuild(symbols)
+        return symbols
+
+    def new_symbols(self):
+        with self.lock:
+            return sorted(self.new)
+
+    def dirty_symbols(self):
+        with self.lock:
+            return sorted(self.dirty)
+
+    def clear_dirty(self, symbols=None):
+        with self.lock:
+            if symbols is None:
+                self.dirty = set()
+            else:
+                self.dirty.difference_update(symbols)
+
+    def snapshot(self, symbols=None):
+        """
+        返回与 daily_stock_moving_averages 表结构一致的 DataFrame。
+
+        :param symbols: 股票代码列表（可选，默认为全部）
+        """
+        with self.lock:
+            if symbols is None:
+                symbols = sorted(self.states)
+            rows = [[symbol, self.states[symbol].last_date] + self.states[symbol].values()
+                    for symbol in symbols if symbol in self.states]
+        return pd.DataFrame(rows, columns=COLUMNS)
+
+    def save(self):
+        """
+        以 .npy 列文件保存状态，先写入临时目录再替换。
+        """
+        with self.lock:
+            symbols = sorted(self.states)
+            states = [self.states[symbol] for symbol in symbols]
+            n = len(states)
+            max_queue = np.full((n, WINDOW), -1, dtype='int64')
+            min_queue = np.full((n, WINDOW), -1, dtype='int64')
+            for i, state in enumerate(states):
+                max_queue[i, :len(state.max_queue)] = state.max_queue
+                min_queue[i, :len(state.min_queue)] = state.min_queue
+            arrays = {
+                'symbol': np.array(symbols, dtype=str),
+                'last_date': np.array([state.last_date for state in states], dtype=str),
+                'count': np.array([state.count for state in states], dtype='int64'),
+                'ring': np.array([state.ring for state in states]).reshape(n, WINDOW),
+                'sums': np.array([state.sums for state in states]).reshape(n, len(MA_WINDOWS)),
+                'max_queue': max_queue,
+                'min_queue': min_queue,
+                'dirty': np.array([symbol in self.dirty for symbol in symbols], dtype=bool),
+                'new': np.array([symbol in self.new for symbol in symbols], dtype=bool),
+            }
+
+        tmp_dir = CACHE_DIR + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+        if os.path.exists(CACHE_DIR):
+            shutil.rmtree(CACHE_DIR)
+        os.rename(tmp_dir, CACHE_DIR)
+
+    @classmethod
+    def load(cls):
+        """
+        读取保存的状态，不存在时返回空的 IndicatorStore。
+        """
+        store = cls()
+        if not os.path.exists(os.path.join(CACHE_DIR, 'symbol.npy')):
+            return store
+
+        arrays = {name: np.load(os.path.join(CACHE_DIR, f'{name}.npy'))
+                  for name in ['symbol', 'last_date', 'count', 'ring', 'sums', 'max_queue', 'min_queue', 'dirty', 'new']}
+        for i, symbol in enumerate(arrays['symbol'].tolist()):
+            state = SymbolState()
+            state.ring = arrays['ring'][i].copy()
+            state.count = int(arrays['count'][i])
+            state.sums = arrays['sums'][i].tolist()
+            max_queue, min_queue = arrays['max_queue'][i], arrays['min_queue'][i]
+            state.max_queue = deque(max_queue[max_queue >= 0].tolist())
+            state.min_queue = deque(min_queue[min_queue >= 0].tolist())
+            state.last_date = str(arrays['last_date'][i])
+            store.states[symbol] = state
+            if arrays['dirty'][i]:
+                store.dirty.add(symbol)
+            if arrays['new'][i]:
+                store.new.add(symbol)
+        return store
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from database import mydb
+
+#####################################
+# 指标计算模块：一次读取价格表，在 pandas/NumPy 中向量化计算全部股票的指标
+# usage:
+# import indicators
+# indicators.calculate_moving_averages()
+# indicators.calculate_rs_ratings(sessions=5)
+#####################################
+
+
+MA_WINDOWS = (50, 150, 200)
+# 52 周约等于 252 个交易日
+WEEKS_52_WINDOW = 252
+# 读取价格时向前回溯的自然日数，需覆盖 252 个交易日
+LOOKBACK_DAYS = 400
+
+# IBD 风格的相对强度：最近 3/6/9/12 个月收益的加权和，最近一个季度权重加倍
+RS_PERIODS = (63, 126, 189, 252)
+RS_WEIGHTS = (0.4, 0.2, 0.2, 0.2)
+# 停牌或其他市场休市时，用前值填充的最大交易日数
+RS_FILL_LIMIT = 5
+
+
+def calculate_moving_averages_from_prices(df, ma_windows=MA_WINDOWS, extreme_window=WEEKS_52_WINDOW):
+    """
+    根据日线收盘价计算每只股票最新交易日的均线与 52 周高低点。
+
+    :param df: 包含 symbol, date, close 的 DataFrame
+    :return: 与 daily_stock_moving_averages 表结构一致的 DataFrame
+    """
+    columns = ['symbol', 'date', 'current_price'] + [f'ma_{n}' for n in ma_windows] + \
+              ['high_of_52weeks', 'low_of_52weeks']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    df = df.sort_values(['symbol', 'date']).reset_index(drop=True)
+
+    # 每只股票从最新一天往前的序号，0 表示最新交易日
+    position = df.groupby('symbol', sort=False).cumcount(ascending=False).to_numpy()
+
+    result = df.loc[position == 0, ['symbol', 'date', 'close']].rename(columns={'close': 'current_price'})
+    result = result.set_index('symbol')
+
+    # 最近 n 个交易日的平均收盘价（不足 n 天时取已有数据的均值）
+    for n in ma_windows:
+        result[f'ma_{n}'] = df.loc[position < n].groupby('symbol')['close'].mean()
+
+    # 最近 52 周的最高/最低收盘价
+    recent_close = df.loc[position < extreme_window].groupby('symbol')['close']
+    result['high_of_52weeks'] = recent_close.max()
+    result['low_of_52weeks'] = recent_close.min()
+
+    return result.reset_index()[columns]
+
+
+def calculate_moving_averages():
+    """
+    批量计算所有活跃股票的均线，只读取一次价格表。
+    """
+    start_date = (datetime.now() - timedelta(days=LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    df = mydb.query_active_close_prices(start_date)
+    return calculate_moving_averages_from_prices(df)
+
+
+def calculate_rs_ratings_from_prices(df, sessions=None, periods=RS_PERIODS, weights=RS_WEIGHTS):
+    """
+    计算每只股票每个交易日的加权收益 rs_score，并在同一交易日的全部股票中排名为 1~99 的 rs_rating。
+
+    价格先转为 日期 × 股票 的矩阵，收益和排名都按整行计算，不需要逐只股票循环。
+    只有具备完整 12 个月历史的股票参与排名。
+    各市场的休市日不同，df 包含 region 列时按地区分别建立矩阵和排名，收益的偏移量是该市场自己的交易日。
+
+    :param df: 包含 symbol, date, close（可选 region）的 DataFrame
+    :param sessions: 只计算最近的 sessions 个交易日（每日刷新时只需最新几天），None 表示全部
+    :return: 包含 date, symbol, rs_score, rs_rating 的 DataFrame
+    """
+    columns = ['date', 'symbol', 'rs_score', 'rs_rating']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    if 'region' in df.columns:
+        results = [calculate_rs_ratings_from_prices(group.drop(columns='region'), sessions, periods, weights)
+                   for _, group in df.groupby('region')]
+        results = [result for result in results if not result.empty]
+        if len(results) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(results, ignore_index=True)[columns]
+
+    prices = df.pivot_table(index='date', columns='symbol', values='close', aggfunc='last', observed=True)
+    prices = prices.sort_index().ffill(limit=RS_FILL_LIMIT)
+    values = prices.to_numpy(dtype='float64')
+
+    longest = max(periods)
+    first_row = longest if sessions is None else max(longest, len(values) - sessions)
+    if first_row >= len(values):
+        return pd.DataFrame(columns=columns)
+
+    current = values[first_row:]
+    score = np.zeros_like(current)
+    for period, weight in zip(periods, weights):
+        score += weight * (current / values[first_row - period:len(values) - period] - 1)
+    score[~np.isfinite(score)] = np.nan
+
+    score = pd.DataFrame(score, index=prices.index[first_row:], columns=prices.columns)
+    # 按行计算百分位，映射到 1~99
+    rating = (score.rank(axis=1, pct=True) * 99).round().clip(1, 99)
+
+    result = pd.DataFrame({
+        'rs_score': score.stack(),
+        'rs_rating': rating.stack()
+    }).dropna().reset_index()
+    result['rs_score'] = result['rs_score'].round(6)
+    result['rs_rating'] = result['rs_rating'].astype(int)
+    return result[columns]
+
+
+def calculate_rs_ratings(sessions=None):
+    """
+    批量计算所有活跃股票的 RS rating。
+
+    :param sessions: 只计算最近的 sessions 个交易日
+    """
+    start_date = (datetime.now() - timedelta(days=LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    df = mydb.query_active_close_prices(start_date)
+    return calculate_rs_ratings_from_prices(df, sessions)
@@ -1,29 +1,92 @@
 import pandas as pd
-from database import mydb
+from database import price_cache
+import matplotlib
 import mplfinance as mpf
 from tools import utils
 import os
+import json
+import shutil
+import hashlib
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+CHART_KWARGS = dict(type='candle', mav=(5, 20, 50), volume=True, figratio=(12, 8), figscale=1.5)
+CHART_STYLE = 'checkers'
+CHART_MANIFEST = 'charts.json'
+
+
+def chart_key(df):
+    """
+    根据 K 线数据和绘图参数生成图表的哈希值，数据不变时哈希值不变。
+    """
+    columns = ['date', 'open', 'high', 'low', 'close', 'volume']
+    data = df.reset_index()[columns]
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    digest.update(json.dumps({**CHART_KWARGS, 'style': CHART_STYLE}, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _init_worker():
+    """
+    绘图子进程使用无界面后端，不影响导入本模块的进程（如 notebook）。
+    """
+    matplotlib.use('Agg')
+
+
+def render_chart(df, symbol, save_path):
+    """
+    绘制单只股票的 K 线图，可在子进程中运行。
+    """
+    title = {"title": symbol, "y": 1}
+    mpf.plot(df, **CHART_KWARGS, title=title, style=CHART_STYLE, savefig=save_path, tight_layout=True)
+    return symbol
 
 
 
 class Monitor:
 
-    def __init__(self):
+    def __init__(self, output_root=None):
         # 获取当前日期
         current_date = datetime.now().date()
         # 将日期转换为字符串
         self.date_string = current_date.strftime('%Y-%m-%d')
-        root_path = utils.get_root_path()
-        self.parent_folder = os.path.join(root_path, 'output')
-        self.output_folder = os.path.join(root_path, 'output', self.date_string)
+        if output_root is None:
+            output_root = os.path.join(utils.get_root_path(), 'output')
+        self.parent_folder = output_root
+        self.output_folder = os.path.join(output_root, self.date_string)
         # 确保输出文件夹存在
         os.makedirs(self.output_folder, exist_ok=True)
 
-    def plot_stocks_in_grid(self, dfs):
-        for i, df in enumerate(dfs):
+    def _load_previous_manifest(self):
+        """
+        读取最近一次输出目录中的图表清单，返回 (目录, {symbol: 哈希值})。
+        """
+        folders = sorted(f for f in os.listdir(self.parent_folder)
+                         if os.path.isfile(os.path.join(self.parent_folder, f, CHART_MANIFEST)))
+        if len(folders) == 0:
+            return None, {}
+        # 优先使用当天的清单（同一天重复运行），否则使用最近一天的
+        folder = os.path.join(self.parent_folder, folders[-1])
+        with open(os.path.join(folder, CHART_MANIFEST), 'r') as f:
+            return folder, json.load(f)
+
+    def plot_stocks_in_grid(self, dfs, workers=None):
+        """
+        多进程绘制 K 线图，与上次输出相比数据未变化的图表直接复用。
+
+        :param dfs: 每只股票一个 DataFrame
+        :param workers: 进程数，默认为 CPU 核数
+        :return: 绘制和跳过的图表数量
+        """
+        previous_folder, previous_manifest = self._load_previous_manifest()
+        manifest = {}
+        tasks = []
+        skipped = 0
+
+        for df in dfs:
             symbol = df['symbol'].iloc[0]
-            title = {"title": symbol, "y": 1}
+            df = df.copy()
 
             # 确保 Date 列为 datetime 格式
             df['date'] = pd.to_datetime(df['date'])
@@ -31,10 +94,39 @@ class Monitor:
             # 设置 Date 列为索引
             df.set_index('date', inplace=True)
 
-            # First we set the kwargs that we will use for all of these examples:
-            kwargs = dict(type='candle', mav=(5, 20, 50), volume=True, figratio=(12, 8), figscale=1.5)
+            key = chart_key(df)
+            manifest[symbol] = key
             save_path = os.path.join(self.output_folder, f'{symbol}.png')
-            mpf.plot(df, **kwargs, title=title, style='checkers', savefig=save_path, tight_layout=True)
+
+            # 数据和参数都未变化，复用上次的图表
+            if previous_manifest.get(symbol) == key:
+                previous_path = os.path.join(previous_folder, f'{symbol}.png')
+                if os.path.exists(previous_path):
+                    if previous_path != save_path:
+                        shutil.copyfile(previous_path, save_path)
+                    skipped += 1
+                    continue
+
+            tasks.append((df, symbol, save_path))
+
+        rendered = 0
+        if len(tasks) > 0:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {executor.submit(render_chart, *task): task[1] for task in tasks}
+                for future, symbol in futures.items():
+                    try:
+                        future.result()
+                        rendered += 1
+                    except Exception as e:
+                        # 绘制失败的图表不记入清单，下次重新绘制
+                        manifest.pop(symbol, None)
+                        print(f"Error rendering chart for {symbol}: {e}")
+
+        with open(os.path.join(self.output_folder, CHART_MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+
+        print(f"{rendered} charts rendered, {skipped} charts skipped.")
+        return {'rendered': rendered, 'skipped': skipped}
 
     def generate_html(self):
         # 获取所有图片文件
@@ -105,7 +197,7 @@ class Monitor:
         print(f'HTML file generated at: {html_file_path}')
 
     def plot_all(self):
-        df = mydb.get_screening_results(ma_200_up_trend=True, profit_up_trend=True, cup_with_handle=False)
+        df = price_cache.get_screening_results(ma_200_up_trend=True, profit_up_trend=True, cup_with_handle=False)
         dfs = [group for _, group in df.groupby('symbol')]
         # 调用函数
         self.plot_stocks_in_grid(dfs)
@@ -0,0 +1,228 @@
+import json
+import os
+import time
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from database import mydb
+from database import price_cache
+from daily_prices import DailyPrices
+from monitor import Monitor
+from tools import utils
+from tools.metrics import registry
+
+
+class Stage:
+    """
+    流水线中的一个阶段。
+
+    :param name: 阶段名称
+    :param func: 阶段执行的函数
+    :param inputs: 阶段读取的资源名称，资源未变化时跳过该阶段
+    :param outputs: 阶段写入的资源名称
+    :param depends_on: 必须先完成的阶段名称
+    :param upstream: 以其输出版本（上次成功完成的时间）作为输入的阶段，必须包含在 depends_on 中；
+                     多个阶段依次修改同一张表时用它代替表的指纹，下游阶段修改该表不会让上游阶段重跑
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), depends_on=(), upstream=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends_on = list(depends_on)
+        self.upstream = list(upstream)
+
+
+class Pipeline:
+    """
+    可断点续跑的流水线：
+    - 输入资源的指纹与上次成功运行时相同的阶段直接跳过；
+    - 某个阶段失败后，下次运行时已成功且输入未变化的阶段会被跳过，相当于从失败的阶段继续；
+    - 互不依赖的阶段并发执行；
+    - 每次运行记录各阶段耗时。
+    """
+
+    def __init__(self, stages, resources, workers=4, name='sepa'):
+        self.stages = {stage.name: stage for stage in stages}
+        self.resources = resources
+        self.workers = workers
+        self.cache_dir = os.path.join(utils.get_root_path(), 'cache', 'pipeline', name)
+        self.state_path = os.path.join(self.cache_dir, 'state.json')
+        self.state = {}
+        os.makedirs(os.path.join(self.cache_dir, 'runs'), exist_ok=True)
+
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Invalid dependency '{dependency}' for stage '{stage.name}'.")
+            for resource in stage.inputs:
+                if resource not in self.resources:
+                    raise ValueError(f"Invalid input '{resource}' for stage '{stage.name}'.")
+            for name in stage.upstream:
+                if name not in stage.depends_on:
+                    raise ValueError(f"Upstream stage '{name}' must be a dependency of stage '{stage.name}'.")
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r') as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _fingerprint(self, stage):
+        fingerprint = {resource: str(self.resources[resource]()) for resource in stage.inputs}
+        # 上游阶段在本阶段提交前已完成，state 中是其最近一次成功的时间
+        for name in stage.upstream:
+            fingerprint[f'stage:{name}'] = self.state.get(name, {}).get('finished_at')
+        return fingerprint
+
+    def _run_stage(self, stage, previous, force):
+        """
+        执行单个阶段，返回该阶段的运行记录。
+        """
+        start_time = time.perf_counter()
+        fingerprint = self._fingerprint(stage)
+
+        # 没有声明输入的阶段每次都执行
+        if not force and (stage.inputs or stage.upstream) and previous.get('status') == 'success' and previous.get('inputs') == fingerprint:
+            return {'status': 'skipped', 'inputs': fingerprint, 'seconds': time.perf_counter() - start_time}
+
+        stage.func()
+        registry.histogram('pipeline_stage_duration_seconds').observe(time.perf_counter() - start_time,
+                                                                      stage=stage.name)
+        return {'status': 'success', 'inputs': fingerprint, 'seconds': time.perf_counter() - start_time}
+
+    def run(self, force=False):
+        """
+        执行流水线，返回各阶段的运行记录。
+
+        :param force: 为 True 时忽略缓存，执行所有阶段
+        """
+        state = self._load_state()
+        self.state = state
+        records = {}
+        pending = dict(self.stages)
+        running = {}
+        failed = False
+        started_at = datetime.now()
+        run_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                # 提交依赖已完成的阶段
+                if not failed:
+                    for name, stage in list(pending.items()):
+                        if all(records.get(d, {}).get('status') in ('success', 'skipped') for d in stage.depends_on):
+                            running[executor.submit(self._run_stage, stage, state.get(name, {}), force)] = name
+                            del pending[name]
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        record = future.result()
+                        print(f"Stage {name} {record['status']} in {record['seconds']:.1f}s.")
+                    except Exception as e:
+                        failed = True
+                        record = {'status': 'failed', 'error': repr(e), 'seconds': None}
+                        print(f"Stage {name} failed: {e}")
+                        traceback.print_exc()
+
+                    records[name] = record
+                    if record['status'] == 'success':
+                        state[name] = {'status': 'success', 'inputs': record['inputs'],
+                                       'finished_at': datetime.now().isoformat()}
+                    elif record['status'] == 'failed':
+                        state[name] = {'status': 'failed', 'finished_at': datetime.now().isoformat()}
+                    self._save_state(state)
+
+        for name in pending:
+            records[name] = {'status': 'not_run', 'seconds': None}
+
+        elapsed = time.perf_counter() - run_start
+        run_record = {
+            'started_at': started_at.isoformat(),
+            'seconds': elapsed,
+            'status': 'failed' if failed else 'success',
+            'stages': {name: {k: v for k, v in record.items() if k != 'inputs'} for name, record in records.items()}
+        }
+        run_path = os.path.join(self.cache_dir, 'runs', started_at.strftime('%Y%m%d_%H%M%S') + '.json')
+        with open(run_path, 'w') as f:
+            json.dump(run_record, f, indent=2)
+
+        print(f"Pipeline {run_record['status']} in {elapsed:.1f}s.")
+        utils.export_metrics()
+        return run_record
+
+
+def build_sepa_pipeline(workers=4):
+    """
+    每日 SEPA 筛选流程。
+    """
+    dp = DailyPrices()
+
+    def plot_all():
+        monitor = Monitor()
+        monitor.plot_all()
+        monitor.generate_html()
+
+    resources = {
+        'trading_date': lambda: datetime.now().strftime('%Y-%m-%d'),
+        'tickers': lambda: mydb.query_table_checksum('tickers'),
+        'daily_stock_prices_realtime': lambda: mydb.query_price_watermark(),
+        'daily_stock_moving_averages': lambda: mydb.query_table_checksum('daily_stock_moving_averages'),
+        'daily_stock_rs_ratings': lambda: mydb.query_table_checksum('daily_stock_rs_ratings'),
+    }
+
+    stages = [
+        # 在入库之前滚动，入库之后 realtime 表的指纹在当天保持稳定
+        Stage('rollover_prices', dp.rollover_prices,
+              inputs=['trading_date'], outputs=['daily_stock_prices_realtime']),
+        Stage('update_daily_prices', dp.update_daily_prices,
+              inputs=['trading_date'], outputs=['daily_stock_prices_realtime'],
+              depends_on=['rollover_prices']),
+        # 本地价格缓存的同步与标记无效股票、计算均线等阶段并发执行
+        Stage('sync_price_cache', price_cache.sync,
+              inputs=['daily_stock_prices_realtime'], depends_on=['update_daily_prices']),
+        Stage('mark_invalid_tickers', dp.mark_invalid_tickers,
+              inputs=['tickers', 'daily_stock_prices_realtime'], outputs=['tickers'],
+              depends_on=['update_daily_prices']),
+        Stage('update_moving_averages', dp.update_moving_averages,
+              inputs=['tickers', 'daily_stock_prices_realtime'], outputs=['daily_stock_moving_averages'],
+              depends_on=['mark_invalid_tickers']),
+        Stage('update_rs_ratings', dp.update_rs_ratings,
+              inputs=['tickers', 'daily_stock_prices_realtime'], outputs=['daily_stock_rs_ratings'],
+              depends_on=['mark_invalid_tickers']),
+        Stage('save_screening_output', dp.save_screening_output,
+              inputs=['daily_stock_moving_averages'], outputs=['screening_output'],
+              depends_on=['update_moving_averages']),
+        # 各筛选阶段依次修改 screening_output，只以上游数据和前一个筛选阶段的输出版本作为输入，
+        # 不使用 screening_output 的指纹，否则后面的阶段修改该表会让前面的阶段在重跑时失效
+        Stage('apply_ma_200_up_trend_filter', dp.apply_ma_200_up_trend_filter,
+              inputs=['daily_stock_moving_averages', 'daily_stock_prices_realtime'], outputs=['screening_output'],
+              depends_on=['save_screening_output', 'sync_price_cache'], upstream=['save_screening_output']),
+        Stage('apply_profit_up_trend_filter', dp.apply_profit_up_trend_filter,
+              inputs=['trading_date'], outputs=['screening_output'],
+              depends_on=['apply_ma_200_up_trend_filter'], upstream=['apply_ma_200_up_trend_filter']),
+        Stage('apply_cup_with_handle_symbols_filter', dp.apply_cup_with_handle_symbols_filter,
+              inputs=['daily_stock_prices_realtime'], outputs=['screening_output'],
+              depends_on=['apply_profit_up_trend_filter'], upstream=['apply_profit_up_trend_filter']),
+        Stage('plot_all', plot_all,
+              inputs=['daily_stock_prices_realtime', 'trading_date'],
+              depends_on=['apply_cup_with_handle_symbols_filter'], upstream=['apply_cup_with_handle_symbols_filter']),
+    ]
+    return Pipeline(stages, resources, workers=workers)
+
+
+if __name__ == '__main__':
+    pipeline = build_sepa_pipeline()
+    pipeline.run()
@@ -9,50 +9,87 @@ class Tickers:
         self.av_api = AlphaVantageAPI()
         self.ak_api = AKShareAPI()
 
-    @staticmethod
-    def _get_new_tickers(existing_tickers, new_tickers):
+    # 来自上市列表、需要与 tickers 表同步的字段；status 由本项目自己维护（Inactive、Exclude 等），不被列表覆盖，
+    # 只有 Delisted 的股票重新出现在列表中时恢复为 Active（可能是某次列表异常或下载失败误标的）
+    SYNC_COLUMNS = ['name', 'exchange', 'ipo_date']
+    ACTIVE_STATUS = 'Active'
+    DELISTED_STATUS = 'Delisted'
+
+    @classmethod
+    def _hash_rows(cls, df):
+        """
+        按 SYNC_COLUMNS 计算每行的哈希，日期和空值先统一为字符串，数据库与列表中的同一行得到相同哈希。
+        """
+        normalized = pd.DataFrame({
+            'name': df['name'].fillna('').astype(str).str.strip(),
+            'exchange': df['exchange'].fillna('').astype(str).str.strip(),
+            'ipo_date': pd.to_datetime(df['ipo_date'], errors='coerce').dt.strftime('%Y-%m-%d').fillna(''),
+        })
+        return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+    @classmethod
+    def diff_tickers(cls, existing_tickers, new_tickers):
         """
-        获取增量部分的新 ticker。
+        对比 tickers 表与最新上市列表。
+
+        :return: (inserted, changed, disappeared, relisted)
+            inserted: 列表中新出现的股票
+            changed: 两边都有但 SYNC_COLUMNS 有变化的股票
+            disappeared: 表中 Active、但已不在列表中的股票 symbol
+            relisted: 表中 Delisted、但仍在列表中的股票 symbol
         """
-        # 将 existing_tickers 的 symbol 转换为集合
-        existing_symbols = set(existing_tickers['symbol'])
+        existing = existing_tickers[['symbol', 'status']].copy()
+        existing['hash'] = cls._hash_rows(existing_tickers) if not existing_tickers.empty else []
+        incoming = new_tickers.drop_duplicates('symbol', keep='last').copy()
+        incoming['hash'] = cls._hash_rows(incoming) if not incoming.empty else []
 
-        # 过滤出 new_tickers 中不在 existing_tickers 中的行
-        new_tickers_filtered = new_tickers[~new_tickers['symbol'].isin(existing_symbols)]
+        merged = incoming.merge(existing, on='symbol', how='outer', suffixes=('', '_existing'), indicator=True)
+        inserted = merged[merged['_merge'] == 'left_only']
+        changed = merged[(merged['_merge'] == 'both') & (merged['hash'] != merged['hash_existing'])]
+        disappeared = merged[(merged['_merge'] == 'right_only') & (merged['status_existing'] == cls.ACTIVE_STATUS)]
+        relisted = merged[(merged['_merge'] == 'both') & (merged['status_existing'] == cls.DELISTED_STATUS)]
 
-        return new_tickers_filtered
+        columns = ['symbol'] + cls.SYNC_COLUMNS + ['status']
+        return inserted[columns], changed[columns], disappeared['symbol'].tolist(), relisted['symbol'].tolist()
 
     def update_tickers_by_region(self, region):
         """
-        根据 region 更新 tickers 表。
+        根据 region 更新 tickers 表：新股票插入，名称/交易所/IPO 日期有变化的更新，已不在列表中的标记为 Delisted，
+        重新出现在列表中的 Delisted 股票恢复为 Active。
         """
-        # 获取现有 tickers 数据
-        existing_tickers = mydb.query_tickers_by_region(region)
+        # 与该地区所有状态的股票对比，避免把已标记为其他状态的股票当作新股票
+        existing_tickers = mydb.query_tickers_by_region(region, active_only=False)
 
         # 根据 region 获取新的 tickers 数据
         if region == 'us':
             new_tickers = self.av_api.get_tickers()
         else:
             new_tickers = self.ak_api.get_tickers(region)
-        print(f"Got {len(new_tickers)} new tickers for region '{region}'.")
+        print(f"Got {len(new_tickers)} tickers for region '{region}'.")
+        if new_tickers.empty:
+            # 列表为空多半是接口异常，不能据此把所有股票标记为 Delisted
+            print(f"Empty ticker list for region '{region}', skipped.")
+            return
 
-        # 获取增量部分的新 ticker
-        new_tickers_filtered = self._get_new_tickers(existing_tickers, new_tickers)
+        new_tickers = new_tickers.copy()
+        new_tickers['ipo_date'] = new_tickers['ipo_date'].replace('', None)
+        inserted, changed, disappeared, relisted = self.diff_tickers(existing_tickers, new_tickers)
+        print(f"Region '{region}': {len(inserted)} inserted, {len(changed)} changed, {len(disappeared)} disappeared, "
+              f"{len(relisted)} relisted.")
 
-        if not new_tickers_filtered.empty:
-            # 添加 region 字段
-            new_tickers_filtered["region"] = region
+        # 新增和变化的股票一次批量 upsert；已存在的股票只更新 SYNC_COLUMNS，不覆盖 status
+        upserts = pd.concat([inserted, changed], ignore_index=True)
+        if not upserts.empty:
+            upserts['region'] = region
+            upserts = upserts[["symbol", "name", "region", "exchange", "ipo_date", "status"]]
+            upserts['ipo_date'] = pd.to_datetime(upserts['ipo_date'], errors='coerce').dt.date
+            upserts = upserts.astype(object).where(upserts.notna(), None)
+            mydb.write_df_to_table(upserts, "tickers", upsert=True, update_columns=self.SYNC_COLUMNS)
 
-            # 只保留需要的字段：symbol, name, region, exchange, ipo_date
-            new_tickers_filtered = new_tickers_filtered[["symbol", "name", "region", "exchange", "ipo_date", "status"]]
-            # 将 ipo_date 字段的空字符串替换为 NULL
-            new_tickers_filtered["ipo_date"] = new_tickers_filtered["ipo_date"].replace('', None)
-
-            # 将增量数据插入数据库
-            mydb.write_df_to_table(new_tickers_filtered, "tickers")
-            print(f"Added {len(new_tickers_filtered)} new tickers for region '{region}'.")
-        else:
-            print(f"No new tickers to add for region '{region}'.")
+        if len(disappeared) > 0:
+            mydb.update_ticker_status(self.DELISTED_STATUS, disappeared)
+        if len(relisted) > 0:
+            mydb.update_ticker_status(self.ACTIVE_STATUS, relisted)
 
     def update_tickers(self, region_list):
         """
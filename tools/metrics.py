@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+#####################################
+# 进程内的运行指标：计数器、仪表和延迟直方图
+# 可导出为 JSON 快照和 Prometheus 文本格式
+# usage:
+# from tools.metrics import registry
+# registry.counter('rows_written_total').inc(100, table='tickers')
+# registry.export(directory)
+#####################################
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if len(items) == 0:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in items) + '}'
+
+
+class Metric:
+    type_name = ''
+
+    def __init__(self, name, help_text=''):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self.values.items()]
+
+    def prometheus_lines(self):
+        with self.lock:
+            return [f'{self.name}{_format_labels(key)} {value}' for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text='', buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0, 'max': 0.0}
+                self.values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+            entry['max'] = max(entry['max'], value)
+
+    def snapshot(self):
+        with self.lock:
+            return [{
+                'labels': dict(key),
+                'count': entry['count'],
+                'sum': entry['sum'],
+                'mean': entry['sum'] / entry['count'] if entry['count'] else 0.0,
+                'max': entry['max'],
+                'buckets': dict(zip([str(bound) for bound in self.buckets], entry['buckets']))
+            } for key, entry in self.values.items()]
+
+    def prometheus_lines(self):
+        lines = []
+        with self.lock:
+            for key, entry in self.values.items():
+                # 桶内计数在 observe 时已累计
+                for bound, count in zip(self.buckets, entry['buckets']):
+                    lines.append(f'{self.name}_bucket{_format_labels(key, {"le": bound})} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(key, {"le": "+Inf"})} {entry["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {entry["sum"]}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {entry["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, help_text, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, help_text, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric '{name}' already registered as {metric.type_name}.")
+            return metric
+
+    def counter(self, name, help_text=''):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text=''):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text='', buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'metrics': {metric.name: {'type': metric.type_name, 'help': metric.help_text,
+                                      'values': metric.snapshot()} for metric in metrics}
+        }
+
+    def to_prometheus(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            if metric.help_text:
+                lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.prometheus_lines())
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory):
+        """
+        导出 JSON 快照（按时间保存）和 Prometheus 文本（覆盖 metrics.prom），返回 JSON 文件路径。
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f"metrics_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(json_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        with open(os.path.join(directory, 'metrics.prom'), 'w') as f:
+            f.write(self.to_prometheus())
+        return json_path
+
+
+# 进程内共享的指标注册表
+registry = MetricsRegistry()
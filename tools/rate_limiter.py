@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import date
+
+
+class RateLimiter:
+    """
+    线程安全的令牌桶限流器。
+
+    :param rate: 每秒补充的令牌数
+    :param capacity: 桶容量，即允许的突发请求数
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError(f"Invalid rate: '{rate}'.")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, tokens=1):
+        """
+        获取令牌，令牌不足时阻塞等待。
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class AsyncQuotaScheduler:
+    """
+    asyncio 下按分钟和按天配额调度请求。
+
+    每分钟配额使用滑动窗口：窗口内请求数已满时等待最早的请求移出窗口；
+    每天配额用尽时抛出 QuotaExceededError，而不是等到第二天。
+
+    :param per_minute: 每分钟允许的请求数
+    :param per_day: 每天允许的请求数，None 表示不限制
+    """
+
+    def __init__(self, per_minute, per_day=None):
+        if per_minute <= 0:
+            raise ValueError(f"Invalid per_minute: '{per_minute}'.")
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.window = deque()
+        self.day = None
+        self.day_count = 0
+        self.lock = None
+
+    def _get_lock(self):
+        # asyncio.Lock 需要在事件循环中创建
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    def remaining_today(self):
+        if self.per_day is None:
+            return None
+        if self.day != date.today():
+            return self.per_day
+        return self.per_day - self.day_count
+
+    async def acquire(self):
+        """
+        等待直到可以发出下一个请求。
+        """
+        async with self._get_lock():
+            today = date.today()
+            if self.day != today:
+                self.day = today
+                self.day_count = 0
+            if self.per_day is not None and self.day_count >= self.per_day:
+                raise QuotaExceededError(f"Daily quota of {self.per_day} requests exhausted.")
+
+            while True:
+                now = time.monotonic()
+                while self.window and now - self.window[0] >= 60:
+                    self.window.popleft()
+                if len(self.window) < self.per_minute:
+                    break
+                await asyncio.sleep(60 - (now - self.window[0]))
+
+            self.window.append(time.monotonic())
+            self.day_count += 1
@@ -1,21 +1,52 @@
 import time
 import os
+import functools
 import pkg_resources
 from loguru import logger
 from collections.abc import Sequence
+from tools.metrics import registry
 
 
-def timer(func):
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        class_name = args[0].__class__.__name__
-        end_time = time.time()
-        execution_time = end_time - start_time
-        logger.debug(f"{class_name}.{func.__name__} executed in {execution_time:.4f} seconds.")
-        return result
+def timer(func=None, *, metric=None):
+    """
+    记录函数耗时，记入延迟直方图 metric（标签 function 为函数名）。
 
-    return wrapper
+    可以直接使用 @timer，耗时记入 function_duration_seconds 并输出一行 debug 日志；
+    也可以指定指标名 @timer(metric='db_query_duration_seconds')，此时只记入直方图，
+    避免每批调用一次的热点路径刷屏。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            status = 'ok'
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                execution_time = time.perf_counter() - start_time
+                registry.histogram(metric or 'function_duration_seconds').observe(
+                    execution_time, function=func.__qualname__)
+                registry.counter('function_calls_total').inc(function=func.__qualname__, status=status)
+                if metric is None:
+                    logger.debug(f"{func.__qualname__} executed in {execution_time:.4f} seconds.")
+
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def export_metrics():
+    """
+    将本进程的运行指标导出到 cache/metrics 目录。
+    """
+    json_path = registry.export(os.path.join(get_root_path(), 'cache', 'metrics'))
+    logger.info(f"Metrics exported to {json_path}.")
+    return json_path
 
 
 def load_text(*file_paths, by_lines=False):
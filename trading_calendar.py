@@ -0,0 +1,235 @@
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, timedelta
+
+#####################################
+# 交易所交易日历（NYSE / SSE / HKEX）
+# 按规则生成节假日，预先计算每个交易所的交易日和累计交易日数，
+# 任意日期之后缺失的交易日数只需两次数组下标查询，不必访问网络或数据库
+# usage:
+# calendar = trading_calendar.get_calendar('us')
+# calendar.count_sessions('2024-06-14', '2024-06-20')    # 2024-06-14 之后、2024-06-20 之前的交易日数
+# calendar.sessions_start(21, '2024-06-20')              # 最近 21 个交易日的第一天
+# python trading_calendar.py --year 2024                 # 打印各交易所的节假日，便于与官方日历核对
+#####################################
+
+
+START_YEAR = 2000
+END_YEAR = max(2030, datetime.now().year + 1)
+
+# 农历正月初一（2000 ~ 2030），范围外的年份不计春节假期
+LUNAR_NEW_YEAR = {
+    2000: '2000-02-05', 2001: '2001-01-24', 2002: '2002-02-12', 2003: '2003-02-01', 2004: '2004-01-22',
+    2005: '2005-02-09', 2006: '2006-01-29', 2007: '2007-02-18', 2008: '2008-02-07', 2009: '2009-01-26',
+    2010: '2010-02-14', 2011: '2011-02-03', 2012: '2012-01-23', 2013: '2013-02-10', 2014: '2014-01-31',
+    2015: '2015-02-19', 2016: '2016-02-08', 2017: '2017-01-28', 2018: '2018-02-16', 2019: '2019-02-05',
+    2020: '2020-01-25', 2021: '2021-02-12', 2022: '2022-02-01', 2023: '2023-01-22', 2024: '2024-02-10',
+    2025: '2025-01-29', 2026: '2026-02-17', 2027: '2027-02-06', 2028: '2028-01-26', 2029: '2029-02-13',
+    2030: '2030-02-03',
+}
+
+# NYSE 的临时休市（国丧、911、飓风 Sandy 等）
+NYSE_SPECIAL_CLOSURES = [
+    '2001-09-11', '2001-09-12', '2001-09-13', '2001-09-14', '2004-06-11', '2007-01-02',
+    '2012-10-29', '2012-10-30', '2018-12-05', '2025-01-09',
+]
+
+# 地区对应的交易所，A 股的深交所与上交所休市安排相同
+REGION_EXCHANGES = {'us': 'NYSE', 'cn': 'SSE', 'hk': 'HKEX'}
+
+
+def easter(year):
+    """
+    复活节日期（公历，Anonymous Gregorian algorithm）。
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    """
+    某月第 n 个星期几（weekday: 周一为 0），n 为 -1 时取最后一个。
+    """
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(day):
+    """
+    美国的顺延规则：周六的假日提前到周五，周日的假日顺延到周一。
+    """
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def lunar_new_year_days(year, days=3):
+    if year not in LUNAR_NEW_YEAR:
+        return []
+    first = datetime.strptime(LUNAR_NEW_YEAR[year], '%Y-%m-%d').date()
+    return [first + timedelta(days=i) for i in range(days)]
+
+
+def nyse_holidays(year):
+    holidays = [
+        # 元旦在周六时不提前到上一年的 12 月 31 日
+        date(year, 1, 1) if date(year, 1, 1).weekday() != 6 else date(year, 1, 2),
+        nth_weekday(year, 2, 0, 3),        # Washington's Birthday
+        easter(year) - timedelta(days=2),  # Good Friday
+        nth_weekday(year, 5, 0, -1),       # Memorial Day
+        observed(date(year, 7, 4)),
+        nth_weekday(year, 9, 0, 1),        # Labor Day
+        nth_weekday(year, 11, 3, 4),       # Thanksgiving
+        observed(date(year, 12, 25)),
+    ]
+    if year >= 1998:
+        holidays.append(nth_weekday(year, 1, 0, 3))  # Martin Luther King Jr. Day
+    if year >= 2022:
+        holidays.append(observed(date(year, 6, 19)))  # Juneteenth
+    holidays += [datetime.strptime(day, '%Y-%m-%d').date() for day in NYSE_SPECIAL_CLOSURES
+                 if day.startswith(str(year))]
+    return holidays
+
+
+def sse_holidays(year):
+    """
+    只包含每年必定休市的日期：元旦、春节前三天、劳动节、国庆节前三天。
+    清明、端午、中秋和调休每年由交易所另行公布，未计入，交易日只会多估，不会漏掉。
+    """
+    holidays = [date(year, 1, 1), date(year, 5, 1)] + [date(year, 10, day) for day in (1, 2, 3)]
+    return holidays + lunar_new_year_days(year)
+
+
+def hkex_holidays(year):
+    """
+    固定日期的公众假期和春节前三天，周日的假期顺延到下一个非假期日。
+    清明、佛诞、端午、中秋、重阳按农历或节气，未计入，交易日只会多估。
+    """
+    holidays = [date(year, 1, 1), date(year, 5, 1), date(year, 7, 1), date(year, 10, 1),
+                date(year, 12, 25), date(year, 12, 26)]
+    holidays += lunar_new_year_days(year)
+    good_friday = easter(year) - timedelta(days=2)
+    holidays += [good_friday, good_friday + timedelta(days=3)]  # Good Friday, Easter Monday
+
+    result = set(holidays)
+    for day in sorted(holidays):
+        if day.weekday() == 6:
+            substitute = day + timedelta(days=1)
+            while substitute in result:
+                substitute += timedelta(days=1)
+            result.add(substitute)
+    return sorted(result)
+
+
+EXCHANGE_HOLIDAYS = {'NYSE': nyse_holidays, 'SSE': sse_holidays, 'HKEX': hkex_holidays}
+
+
+def _to_days(dates):
+    return np.asarray(pd.to_datetime(dates), dtype='datetime64[D]')
+
+
+class TradingCalendar:
+    """
+    :param exchange: NYSE、SSE 或 HKEX
+    """
+
+    def __init__(self, exchange, start_year=START_YEAR, end_year=END_YEAR):
+        if exchange not in EXCHANGE_HOLIDAYS:
+            raise ValueError(f"Invalid exchange: '{exchange}'.")
+        self.exchange = exchange
+        holidays = sorted({day for year in range(start_year, end_year + 1)
+                           for day in EXCHANGE_HOLIDAYS[exchange](year)})
+        self.holidays = np.array(holidays, dtype='datetime64[D]')
+
+        self.start = np.datetime64(f'{start_year}-01-01', 'D')
+        days = np.arange(self.start, np.datetime64(f'{end_year + 1}-01-01', 'D'))
+        is_session = np.is_busday(days, holidays=self.holidays)
+        self.sessions = days[is_session]
+        # counts[i] 为 start 到 start + i（包含）之间的交易日数
+        self.counts = np.cumsum(is_session)
+
+    def _count_through(self, days):
+        """
+        不晚于 days 的交易日数，早于日历范围的日期为 0。
+        """
+        index = (days - self.start).astype('int64')
+        counts = self.counts[np.clip(index, 0, len(self.counts) - 1)]
+        return np.where(index < 0, 0, counts)
+
+    def is_session(self, day):
+        return bool(np.is_busday(_to_days(day), holidays=self.holidays))
+
+    def count_sessions(self, after, end_date):
+        """
+        after 之后（不含）、end_date 之前（不含，与 yfinance 的 end 一致）的交易日数。
+
+        :param after: 日期，或日期数组（如每只股票的最新日期）
+        """
+        return self._count_through(_to_days(end_date) - 1) - self._count_through(_to_days(after))
+
+    def next_session(self, after):
+        """
+        after 之后的第一个交易日，可以传入日期数组。
+        """
+        index = np.minimum(self._count_through(_to_days(after)), len(self.sessions) - 1)
+        if np.ndim(index) == 0:
+            return str(self.sessions[index])
+        return pd.to_datetime(self.sessions[index]).strftime('%Y-%m-%d').tolist()
+
+    def sessions_start(self, sessions, end_date):
+        """
+        end_date 之前（不含）最近 sessions 个交易日中的第一天，用于按交易日数确定回溯的开始日期。
+        """
+        index = max(int(self._count_through(_to_days(end_date) - 1)) - sessions, 0)
+        return str(self.sessions[index])
+
+    def sessions_between(self, start_date, end_date):
+        """
+        [start_date, end_date) 之间的交易日列表（YYYY-MM-DD）。
+        """
+        sessions = self.sessions[(self.sessions >= _to_days(start_date)) & (self.sessions < _to_days(end_date))]
+        return pd.to_datetime(sessions).strftime('%Y-%m-%d').tolist()
+
+
+_calendars = {}
+
+
+def get_calendar(region):
+    """
+    返回地区对应交易所的日历，每个交易所只生成一次。
+    """
+    if region not in REGION_EXCHANGES:
+        raise ValueError(f"Invalid region: '{region}'.")
+    exchange = REGION_EXCHANGES[region]
+    if exchange not in _calendars:
+        _calendars[exchange] = TradingCalendar(exchange)
+    return _calendars[exchange]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Print exchange holidays generated from rules.')
+    parser.add_argument('--year', type=int, default=datetime.now().year)
+    args = parser.parse_args()
+
+    for region, exchange in REGION_EXCHANGES.items():
+        calendar = get_calendar(region)
+        holidays = [str(day) for day in calendar.holidays
+                    if str(day).startswith(str(args.year)) and np.is_busday(day)]
+        print(f"{exchange}: {len(calendar.sessions_between(f'{args.year}-01-01', f'{args.year + 1}-01-01'))} "
+              f"sessions, holidays {holidays}")